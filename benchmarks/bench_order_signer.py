@@ -0,0 +1,59 @@
+from random import randint, random
+from copy import deepcopy
+from time import perf_counter
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eth_account import Account
+
+from modules.opinion import Opinion
+from modules.wallet import Wallet
+
+
+def make_message(wallet: Wallet):
+    return {
+        **Opinion.TYPED_DATA["message"],
+        "salt": str(int(random() * 1e12)),
+        "maker": Account.create().address,
+        "signer": wallet.address,
+        "tokenId": str(randint(0, 2 ** 256 - 1)),
+        "makerAmount": str(randint(1, 10 ** 21)),
+        "takerAmount": str(randint(0, 10 ** 21)),
+        "side": str(randint(0, 1)),
+    }
+
+
+def sign_generic(wallet: Wallet, message: dict):
+    typed_data = deepcopy(Opinion.TYPED_DATA)
+    typed_data["message"] = message
+    return wallet.sign_message(typed_data=typed_data)
+
+
+def sign_fast(wallet: Wallet, message: dict):
+    return wallet.sign_hash(Opinion.ORDER_SIGNER.hash_message(message))
+
+
+def bench(name: str, func, wallet: Wallet, messages: list):
+    started_at = perf_counter()
+    for message in messages:
+        func(wallet, message)
+    elapsed = perf_counter() - started_at
+    print(f'{name:<8} {len(messages) / elapsed:>10.1f} orders/s')
+    return elapsed
+
+
+if __name__ == '__main__':
+    orders_amount = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    wallet = Wallet(privatekey=Account.create().key.hex(), encoded_pk="", db=None)
+    messages = [make_message(wallet) for _ in range(orders_amount)]
+
+    for message in messages:
+        assert sign_generic(wallet, message) == sign_fast(wallet, message), "signatures differ"
+    print(f'{orders_amount} signatures are byte-identical')
+
+    generic_time = bench("generic", sign_generic, wallet, messages)
+    fast_time = bench("fast", sign_fast, wallet, messages)
+    print(f'speedup  {generic_time / fast_time:.1f}x')
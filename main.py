@@ -5,66 +5,107 @@ import asyncio
 import os
 
 from modules import *
-from modules.utils import async_sleep
+from modules.utils import async_sleep, make_border
 from modules.retry import DataBaseError, SoftError
-from settings import THREADS, SLEEP_AFTER_ACCOUNT
+from modules.rate_limiter import rate_limiter
+from modules.signing_pool import signing_pool
+from modules.scheduler import WalletScheduler
+from modules.latency_stats import latency_stats
+from settings import THREADS, SLEEP_BETWEEN_ORDERS
 
 
 async def run_modules(
         mode: int,
-        module_data: dict,
-        sem: asyncio.Semaphore,
+        wallet_data: dict,
 ):
-    async with address_locks[module_data["address"]]:
-        async with sem:
-            try:
-                browser = Browser(
-                    proxy=module_data['proxy'],
-                    address=module_data['address'],
-                    db=db,
+    async with address_locks[wallet_data["address"]]:
+        browser = Browser(
+            proxy=wallet_data['proxy'],
+            address=wallet_data['address'],
+            db=db,
+        )
+        opinion = None  # logs in once and is reused for all modules of wallet
+        try:
+            for module_index, module_data in enumerate(wallet_data["modules"]):
+                if module_index:
+                    await async_sleep(randint(*SLEEP_BETWEEN_ORDERS))
+
+                try:
+                    if opinion is None:
+                        wallet = Wallet(
+                            privatekey=db.get_privatekey(wallet_data["encoded_privatekey"]),
+                            encoded_pk=wallet_data["encoded_privatekey"],
+                            db=db,
+                        )
+                        opinion = Opinion(wallet=wallet, browser=browser)
+                    module_data["module_info"]["status"] = await opinion.run(mode=mode)
+
+                except DataBaseError:
+                    wallet_data = None
+                    raise
+
+                except Exception as err:
+                    logger.error(f'[-] Soft | {module_data["address"]} | Global error: {err}')
+                    await db.append_report(encoded_pk=module_data["encoded_privatekey"], text=str(err), success=False)
+
+                finally:
+                    if type(wallet_data) == dict:
+                        if mode == 1:
+                            await db.remove_module(module_data)
+                        else:
+                            await db.remove_account(module_data)
+
+        finally:
+            await browser.close_sessions()
+            if type(wallet_data) == dict:
+                reports = await db.get_account_reports(
+                    encoded_pk=wallet_data["encoded_privatekey"],
+                    address=wallet_data["address"],
                 )
-                wallet = Wallet(
-                    privatekey=module_data["privatekey"],
-                    encoded_pk=module_data["encoded_privatekey"],
-                    db=db,
-                )
-                module_data["module_info"]["status"] = await Opinion(wallet=wallet, browser=browser).run(mode=mode)
-
-            except DataBaseError:
-                module_data = None
-                raise
-
-            except Exception as err:
-                logger.error(f'[-] Soft | {wallet.address} | Global error: {err}')
-                await db.append_report(encoded_pk=module_data["encoded_privatekey"], text=str(err), success=False)
-
-            finally:
-                if type(module_data) == dict:
-                    await browser.close_sessions()
-                    if mode  == 1:
-                        await db.remove_module(module_data)
-                    else:
-                        await db.remove_account(module_data)
+                db.release_privatekey(wallet_data["encoded_privatekey"])
+                if opinion is not None:
+                    await opinion.wallet.release_key()
+                await TgReport().send_log(logs=reports)
 
-                    reports = await db.get_account_reports(encoded_pk=module_data["encoded_privatekey"])
-                    await TgReport().send_log(logs=reports)
 
-                    await async_sleep(randint(*SLEEP_AFTER_ACCOUNT))
+async def worker(mode: int, scheduler: WalletScheduler):
+    while (wallet_data := await scheduler.next_wallet()) is not None:
+        await run_modules(mode=mode, wallet_data=wallet_data)
+        scheduler.cooldown(wallet_data)
 
 
 async def runner(mode: int):
-    all_modules = db.get_all_modules(unique_wallets=mode in [2, 3])
-    sem = asyncio.Semaphore(THREADS)
-
-    if all_modules != 'No more accounts left':
-        await asyncio.gather(*[
-            run_modules(
-                mode=mode,
-                module_data=module_data,
-                sem=sem,
-            )
-            for module_data in all_modules
-        ])
+    db.reset_failed_modules()
+    all_wallets = db.get_all_modules(unique_wallets=mode in [2, 3])
+
+    if all_wallets != 'No more accounts left':
+        scheduler = WalletScheduler(all_wallets, deferred_limit=THREADS * 10)
+        tasks = [asyncio.create_task(worker(mode, scheduler)) for _ in range(THREADS)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # on error or Ctrl+C stop every worker and let them finish their `finally` blocks
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            signing_pool.shutdown()
+            await connection_pool.close()
+            await db.close()
+
+            limiter_metrics = {
+                family: f'{metrics["requests"]} requests | avg wait {metrics["avg_wait"]}s | max wait {metrics["max_wait"]}s'
+                for family, metrics in rate_limiter.get_metrics().items()
+            }
+            if limiter_metrics:
+                logger.debug(f'Rate limiter:\n{make_border(limiter_metrics)}')
+
+            latency_metrics = {
+                step: f'{metrics["calls"]} calls | avg {metrics["avg"]}s | max {metrics["max"]}s'
+                for step, metrics in latency_stats.get_metrics().items()
+            }
+            if latency_metrics:
+                logger.debug(f'Latency:\n{make_border(latency_metrics)}')
 
     logger.success(f'All accounts done.')
     return 'Ended'
@@ -74,6 +115,7 @@ if __name__ == '__main__':
     if os.name == "nt":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    db = None
     try:
         db = DataBase()
 
@@ -102,6 +144,8 @@ if __name__ == '__main__':
         pass
 
     finally:
+        if db is not None:
+            db.flush()
         logger.info('[•] Soft | Closed')
 
 
@@ -5,5 +5,5 @@ from .database import DataBase
 from .wallet import Wallet
 
 # modules
-from .browser import Browser
+from .browser import Browser, connection_pool
 from .opinion import Opinion
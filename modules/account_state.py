@@ -0,0 +1,37 @@
+class AccountState:
+    # profile and positions are fetched once and reused until order flow reports fill or cancel
+    def __init__(self, browser):
+        self.browser = browser
+
+        self.profile_info: dict | None = None
+        self.proxy_wallet: str | None = None
+        self.positions: dict[int | None, list] = {}  # topic_id (None for all topics) -> positions
+
+
+    async def get_profile_info(self, fresh: bool = False):
+        if fresh or self.profile_info is None:
+            self.profile_info = await self.browser.get_profile_info()
+            self.proxy_wallet = self.profile_info["multiSignedWalletAddress"].get("56")
+        return self.profile_info
+
+
+    async def get_balance(self, fresh: bool = False):
+        profile_info = await self.get_profile_info(fresh=fresh)
+        return float(profile_info["balance"][0]["balance"])
+
+
+    async def get_positions(self, topic_id: int = None, fresh: bool = False):
+        if fresh or topic_id not in self.positions:
+            self.positions[topic_id] = await self.browser.get_position(topic_id=topic_id)
+        return self.positions[topic_id]
+
+
+    async def get_position(self, topic_id: int, outcome_side: int, fresh: bool = False):
+        positions = await self.get_positions(topic_id=topic_id, fresh=fresh)
+        return next((position for position in positions if position["outcomeSide"] == outcome_side), None)
+
+
+    def invalidate(self):
+        # proxy wallet never changes, only balance and positions
+        self.profile_info = None
+        self.positions.clear()
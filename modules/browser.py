@@ -1,13 +1,54 @@
 from urllib.parse import urlparse, parse_qs
+from contextlib import aclosing
 from random import choices, choice, shuffle
-from aiohttp import ClientSession
+from aiohttp import ClientSession, TCPConnector
+from types import MappingProxyType
 from string import hexdigits
 from loguru import logger
 from time import time
+import asyncio
 
 from modules import DataBase
-from modules.retry import retry, have_json
-from settings import BID_SETTINGS
+from modules.fill_watcher import FillWatcher
+from modules.rate_limiter import rate_limiter
+from modules.retry import retry, have_json, TokenRejected
+from modules.utils import TtlCache
+from settings import BID_SETTINGS, CONNECTION_SETTINGS, CACHE_SETTINGS
+
+
+class ConnectionPool:
+    def __init__(self):
+        self.connectors: dict[str | None, TCPConnector] = {}
+        self.loop = None
+
+
+    def get_connector(self, proxy: str | None):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:  # connectors are bound to event loop they were created in
+            self.connectors.clear()
+            self.loop = loop
+
+        connector = self.connectors.get(proxy)
+        if connector is None or connector.closed:
+            connector = TCPConnector(
+                limit=0,
+                limit_per_host=CONNECTION_SETTINGS["limit_per_host"],
+                ttl_dns_cache=CONNECTION_SETTINGS["dns_cache_ttl"],
+                keepalive_timeout=CONNECTION_SETTINGS["keepalive_timeout"],
+            )
+            self.connectors[proxy] = connector
+        return connector
+
+
+    async def close(self):
+        for connector in self.connectors.values():
+            await connector.close()
+        self.connectors.clear()
+
+
+connection_pool = ConnectionPool()
+topics_cache = TtlCache(ttl=CACHE_SETTINGS["topics_ttl"])
+books_cache = TtlCache(ttl=CACHE_SETTINGS["book_ttl"])
 
 
 class Browser:
@@ -17,15 +58,26 @@ class Browser:
         self.address = address
         self.db = db
 
-        if proxy not in ['https://log:pass@ip:port', 'http://log:pass@ip:port', 'log:pass@ip:port', '', None]:
-            self.proxy = "http://" + proxy.removeprefix("https://").removeprefix("http://")
+        self.proxy = self.normalize_proxy(proxy)
+        if self.proxy:
             logger.opt(colors=True).debug(f'[•] <white>{self.address}</white> | Got proxy <white>{self.proxy}</white>')
         else:
-            self.proxy = None
             logger.opt(colors=True).warning(f'[-] <white>{self.address}</white> | Dont use proxies!')
 
         self.sessions = []
         self.session = self.get_new_session()
+        self.fill_watcher = FillWatcher(browser=self)
+
+        self.relogin = None  # async callback from Opinion, called when token expires in the middle of module
+        self.relogin_task = None
+        self.logging_in = False
+
+
+    @classmethod
+    def normalize_proxy(cls, proxy: str | None):
+        if proxy in ['https://log:pass@ip:port', 'http://log:pass@ip:port', 'log:pass@ip:port', '', None]:
+            return None
+        return "http://" + proxy.removeprefix("https://").removeprefix("http://")
 
 
     def get_new_session(self):
@@ -37,7 +89,11 @@ class Browser:
             "x-device-fingerprint": "".join(choices(hexdigits, k=32)).lower(),
         }
 
-        session = ClientSession(headers=headers)
+        session = ClientSession(
+            headers=headers,
+            connector=connection_pool.get_connector(self.proxy),
+            connector_owner=False,
+        )
         session.proxy = self.proxy
 
         self.sessions.append(session)
@@ -45,6 +101,8 @@ class Browser:
 
 
     async def close_sessions(self):
+        await self.fill_watcher.close()
+        # connections are returned to `connection_pool` and reused by next accounts with same proxy
         for session in self.sessions:
             await session.close()
 
@@ -61,7 +119,35 @@ class Browser:
         if self.proxy:
             kwargs["proxy"] = self.proxy
 
-        return await session.request(**kwargs)
+        for attempt in range(2):
+            await rate_limiter.acquire(url=kwargs["url"], proxy=self.proxy)
+            used_token = session.headers.get("Authorization")
+            response = await session.request(**kwargs)
+            if response.status != 401 or not used_token:
+                return response
+
+            response.release()
+            if attempt or not self.relogin or self.logging_in:
+                raise TokenRejected(f'Auth token rejected for {urlparse(kwargs["url"]).path}')
+            if session.headers.get("Authorization") == used_token:  # not relogged by other request yet
+                await self._relogin()
+
+
+    async def _relogin(self):
+        # concurrent requests with expired token wait for one login
+        if self.relogin_task is None or self.relogin_task.done():
+            self.relogin_task = asyncio.ensure_future(self.relogin())
+        await asyncio.shield(self.relogin_task)
+
+
+    def set_token(self, token: str | None):
+        if token:
+            self.session.headers.update({
+                "Authorization": "Bearer " + token,
+                "x-aws-waf-token": "",
+            })
+        else:
+            self.session.headers.pop("Authorization", None)
 
 
     async def is_user_registered(self, retry: int = 0):
@@ -69,7 +155,7 @@ class Browser:
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v1/user/is/new/user?wallet_address={self.address}',
         )
-        response = await r.json()
+        response = r.data
         if not response.get("result") or "result" not in response["result"]:
             if retry < 5:
                 return await self.is_user_registered(retry + 1)
@@ -91,14 +177,12 @@ class Browser:
                 "sign_in_wallet_plugin": None
             },
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to user login: {response}')
 
-        self.session.headers.update({
-            "Authorization": "Bearer " + response["result"]["token"],
-            "x-aws-waf-token": "",
-        })
+        self.set_token(response["result"]["token"])
+        return response["result"]["token"]
 
 
     async def get_profile_info(self):
@@ -106,7 +190,7 @@ class Browser:
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/user/{self.address}/profile?chainId=56',
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to get profile info: {response}')
         return response["result"]
@@ -117,23 +201,61 @@ class Browser:
             method="GET",
             url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/gnosis_safe/{proxy_address}/approved?chainId=56',
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to get is approved: {response}')
         return response["result"]
 
 
-    async def get_events(self, event_to_find: dict = None):
-        def _parse_event(event: dict, event_name: str = ""):
-            return {
-                "name": event_name + (" " if event_name else "") + event["title"],
-                "prices": [float(event.get("yesBuyPrice") or event["yesMarketPrice"]), float(event.get("noBuyPrice") or event["noMarketPrice"])],
-                "tokens": [event["yesPos"], event["noPos"]],
-                "labels": [event["yesLabel"], event["noLabel"]],
-                "is_child": bool(event_name),
-                "raw_event": event,
-            }
+    @classmethod
+    def _parse_event(cls, event: dict, event_name: str = ""):
+        return {
+            "name": event_name + (" " if event_name else "") + event["title"],
+            "prices": [float(event.get("yesBuyPrice") or event["yesMarketPrice"]), float(event.get("noBuyPrice") or event["noMarketPrice"])],
+            "tokens": [event["yesPos"], event["noPos"]],
+            "labels": [event["yesLabel"], event["noLabel"]],
+            "is_child": bool(event_name),
+            "raw_event": event,
+        }
+
+
+    async def get_topics_catalog(self):
+        # catalog is shared between all accounts, events in it are read-only
+        return await topics_cache.get("topics", self._fetch_topics_catalog)
+
+
+    async def _fetch_topics_catalog(self):
+        r = await self.send_request(
+            method="GET",
+            url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/topic',
+            params={
+                "labelId": "",
+                "keywords": "",
+                "sortBy": 3,
+                "chainId": 56,
+                "limit": 30,
+                "status": 2,
+                "isShow": 1,
+                "topicType": 2,
+                "page": 1,
+                "indicatorType": "2",
+            },
+        )
+        response = r.data
+        if response.get("errmsg") or response.get("errno"):
+            raise Exception(f'Failed to parse events: {response}')
 
+        raw_events = []
+        for event in response["result"]["list"]:
+            if event["childList"]:
+                for child in event["childList"]:
+                    raw_events.append(MappingProxyType(self._parse_event(child, event_name=event["title"])))
+            else:
+                raw_events.append(MappingProxyType(self._parse_event(event)))
+        return tuple(raw_events)
+
+
+    async def get_events(self, event_to_find: dict = None):
         if BID_SETTINGS["LIST"] or BID_SETTINGS["SINGLE_BUY"] or event_to_find:
             if event_to_find:
                 event_url = event_to_find["link"]
@@ -156,12 +278,12 @@ class Browser:
                 method="GET",
                 url=api_url + event_params["topicId"],
             )
-            response = await r.json()
+            response = r.data
             event = response["result"]["data"]
             if event["childList"]:
                 raw_events = []
                 for child in event["childList"]:
-                    parsed_child = _parse_event(child, event_name=event["title"])
+                    parsed_child = self._parse_event(child, event_name=event["title"])
                     if (
                         not event_to_find or
                         parsed_child["raw_event"]["title"] == event_to_find["event_name"]
@@ -171,7 +293,7 @@ class Browser:
 
                         raw_events.append(parsed_child)
             else:
-                parsed_event = _parse_event(event)
+                parsed_event = self._parse_event(event)
                 if event_to_find:
                     parsed_event["force_vote"] = event_to_find["vote"]
                 raw_events = [parsed_event]
@@ -182,54 +304,66 @@ class Browser:
                 parsed_events = []
 
         else:
-            r = await self.send_request(
-                method="GET",
-                url=f'https://proxy.opinion.trade:8443/api/bsc/api/v2/topic',
-                params={
-                    "labelId": "",
-                    "keywords": "",
-                    "sortBy": 3,
-                    "chainId": 56,
-                    "limit": 30,
-                    "status": 2,
-                    "isShow": 1,
-                    "topicType": 2,
-                    "page": 1,
-                    "indicatorType": "2",
-                },
-            )
-            response = await r.json()
-            if response.get("errmsg") or response.get("errno"):
-                raise Exception(f'Failed to parse events: {response}')
-
-            raw_events = []
-            for event in response["result"]["list"]:
-                if event["childList"]:
-                    for child in event["childList"]:
-                        raw_events.append(_parse_event(child, event_name=event["title"]))
-                else:
-                    raw_events.append(_parse_event(event))
-
-            parsed_events = []
+            raw_events = list(await self.get_topics_catalog())
             shuffle(raw_events)
-            for event in raw_events:
-                if min(event["prices"]) * 100 < BID_SETTINGS["PARSE"]["min_event_percent"]: continue
-                book = await self.get_event_book(
-                    question_id=event["raw_event"]["questionId"],
-                    symbol=event["raw_event"]["yesPos"],
-                    event_choice_index=0,
-                )
+            parsed_events = await self.screen_events(
+                events=[
+                    event for event in raw_events
+                    if min(event["prices"]) * 100 >= BID_SETTINGS["PARSE"]["min_event_percent"]
+                ],
+                needed=3,  # to optimize requests
+            )
+
+        if parsed_events:
+            return dict(choice(parsed_events))
+
+
+    async def screen_events(self, events: list, needed: int):
+        sem = asyncio.Semaphore(BID_SETTINGS["PARSE"]["parallel_books"])
+
+        async def _check_spread(event: dict):
+            # broken book (empty side, failed request) only disqualifies its own event
+            try:
+                async with sem:
+                    book = await self.get_event_book(
+                        question_id=event["raw_event"]["questionId"],
+                        symbol=event["raw_event"]["yesPos"],
+                        event_choice_index=0,
+                    )
                 spread = round((book["asks"][0] - book["bids"][0]) * 100, 3)
-                if spread <= BID_SETTINGS["PARSE"]["max_spread"]:
-                    parsed_events.append(event)
-                    if len(parsed_events) > 2: # to optimize requests
+            except Exception as err:
+                logger.opt(colors=True).debug(f'[•] <white>{self.address}</white> | Skip event "{event["name"]}": {err}')
+                return
+            if spread <= BID_SETTINGS["PARSE"]["max_spread"]:
+                return event
+
+        tasks = [asyncio.create_task(_check_spread(event)) for event in events]
+        screened_events = []
+        try:
+            for next_checked in asyncio.as_completed(tasks):
+                event = await next_checked
+                if event:
+                    screened_events.append(event)
+                    if len(screened_events) >= needed:
                         break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-        if parsed_events:
-            return choice(parsed_events)
+        return screened_events
 
 
-    async def get_event_book(self, question_id: str, symbol: str, event_choice_index: int):
+    async def get_event_book(self, question_id: str, symbol: str, event_choice_index: int, fresh: bool = False):
+        # `fresh` skips shared cache, use it when price from book goes straight into order
+        return await books_cache.get(
+            key=(question_id, symbol, event_choice_index),
+            fetch=lambda: self._fetch_event_book(question_id, symbol, event_choice_index),
+            fresh=fresh,
+        )
+
+
+    async def _fetch_event_book(self, question_id: str, symbol: str, event_choice_index: int):
         r = await self.send_request(
             method="GET",
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order/market/depth',
@@ -240,7 +374,7 @@ class Browser:
                 "chainId": "56",
             },
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to get event book: {response}')
 
@@ -248,10 +382,10 @@ class Browser:
         asks = sorted(book["asks"], key=lambda x: float(x[0]))
         bids = sorted(book["bids"], key=lambda x: float(x[0]), reverse=True)
 
-        return {
-            "asks": [float(p[0]) for p in asks],
-            "bids": [float(p[0]) for p in bids],
-        }
+        return MappingProxyType({
+            "asks": tuple(float(p[0]) for p in asks),
+            "bids": tuple(float(p[0]) for p in bids),
+        })
 
 
     async def create_order(
@@ -283,78 +417,119 @@ class Browser:
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order',
             json=payload,
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to create order: {response}')
 
         return response["result"]["orderData"]
 
 
-    async def get_orders(
-            self,
-            order_type: str,
-            topic_id: int = None,
-            trans_no: str = None,
-            is_parent: bool = None,
-    ):
+    async def _iter_pages(self, url: str, params: dict, error_text: str, page_size: int = 100, prefetch: bool = True):
+        # `prefetch=False` for callers that usually stop on first pages - dont spend request on page they wont read
+        async def _fetch_page(page: int):
+            r = await self.send_request(
+                method="GET",
+                url=url,
+                params={**params, "page": page, "limit": page_size},
+            )
+            response = r.data
+            if response.get("errmsg") or response.get("errno") or response.get("result") is None:
+                raise Exception(f'{error_text}: {response}')
+            return response["result"]
+
+        page = 1
+        next_page = asyncio.create_task(_fetch_page(page))
+        try:
+            while next_page:
+                result = await next_page
+                items = result["list"] or []
+                next_page = None
+
+                has_more = len(items) == page_size and (not result.get("total") or page * page_size < result["total"])
+                if has_more and prefetch:  # next page is loading while caller handles current one
+                    next_page = asyncio.create_task(_fetch_page(page + 1))
+                page += 1
+
+                yield items
+
+                if has_more and not prefetch:
+                    next_page = asyncio.create_task(_fetch_page(page))
+        finally:
+            if next_page:
+                next_page.cancel()
+                await asyncio.gather(next_page, return_exceptions=True)
+
+
+    async def iter_orders(self, order_type: str, topic_id: int = None, is_parent: bool = None, prefetch: bool = True):
         params = {
-            "page": 1,
-            "limit": 100,
             "walletAddress": self.address,
+            "queryType": 2 if order_type == "market" else 1,
         }
-        if order_type == "market":
-            params["queryType"] = 2
-        else:
-            params["queryType"] = 1
         if topic_id:
             params["parentTopicId" if is_parent else "topicId"] = topic_id
 
-        r = await self.send_request(
-            method="GET",
+        async with aclosing(self._iter_pages(
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/order',
             params=params,
-        )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno") or response.get("result") is None:
-            raise Exception(f'Failed to get orders: {response}')
+            error_text="Failed to get orders",
+            prefetch=prefetch,
+        )) as pages:
+            async for orders in pages:
+                for order in orders:
+                    yield order
 
-        orders = response["result"]["list"]
-        if not trans_no:
-            return orders or []
 
-        return next((
-            order for order in orders
-            if order["transNo"] == trans_no
-        ), None)
+    async def get_orders(
+            self,
+            order_type: str,
+            topic_id: int = None,
+            trans_no: str = None,
+            is_parent: bool = None,
+    ):
+        orders = []
+        async with aclosing(self.iter_orders(
+            order_type=order_type,
+            topic_id=topic_id,
+            is_parent=is_parent,
+            prefetch=not trans_no,
+        )) as all_orders:
+            async for order in all_orders:
+                if trans_no and order["transNo"] == trans_no:
+                    return order
+                orders.append(order)
 
+        if not trans_no:
+            return orders
 
-    async def get_position(self, topic_id: int = None, outcome_side: int = None):
-        params = {
-            "page": 1,
-            "limit": 100,
-            "walletAddress": self.address,
-        }
+
+    async def iter_positions(self, topic_id: int = None, prefetch: bool = True):
+        params = {"walletAddress": self.address}
         if topic_id:
             params["topicId"] = topic_id
         else:
             params["chainId"] = "56"
-        r = await self.send_request(
-            method="GET",
+
+        async with aclosing(self._iter_pages(
             url='https://proxy.opinion.trade:8443/api/bsc/api/v2/portfolio',
             params=params,
-        )
-        response = await r.json()
-        if response.get("errmsg") or response.get("errno"):
-            raise Exception(f'Failed to get position: {response}')
-
-        positions = response["result"]["list"]
-        if outcome_side:
-            return next((
-                position for position in positions
-                if position["outcomeSide"] == outcome_side
-            ), None)
-        else:
-            return positions or []
+            error_text="Failed to get position",
+            prefetch=prefetch,
+        )) as pages:
+            async for positions in pages:
+                for position in positions:
+                    yield position
+
+
+    async def get_position(self, topic_id: int = None, outcome_side: int = None):
+        positions = []
+        async with aclosing(self.iter_positions(topic_id=topic_id, prefetch=not outcome_side)) as all_positions:
+            async for position in all_positions:
+                if outcome_side and position["outcomeSide"] == outcome_side:
+                    return position
+                positions.append(position)
+
+        if not outcome_side:
+            return positions
 
 
     async def get_rank(self):
@@ -367,7 +542,7 @@ class Browser:
                 "period": "0",
             },
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno"):
             raise Exception(f'Failed to get rank: {response}')
         return response["result"]["id"]
@@ -382,6 +557,6 @@ class Browser:
                 "chainId": 56,
             },
         )
-        response = await r.json()
+        response = r.data
         if response.get("errmsg") or response.get("errno") or not response["result"]["result"]:
             raise Exception(f'Failed to cancel order: {response}')
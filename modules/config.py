@@ -6,19 +6,24 @@ address_locks = defaultdict(asyncio.Lock)
 
 class MultiLock:
     def __init__(self, addresses: list[str]):
-        self.locks = [address_locks[addr] for addr in sorted(addresses)]
+        # locks are always taken in same (sorted) order, so two MultiLocks can't deadlock each other
+        self.locks = [address_locks[addr] for addr in sorted(set(addresses))]
         self.acquired: list[asyncio.Lock] = []
 
     async def __aenter__(self):
-        while True:
-            if all(not lock.locked() for lock in self.locks):
-                for lock in self.locks:
-                    await lock.acquire()
-                    self.acquired.append(lock)
-                return self
-            await asyncio.sleep(1)
+        try:
+            for lock in self.locks:
+                await lock.acquire()  # sleeps until lock is released, no polling
+                self.acquired.append(lock)
+        except BaseException:
+            self._release()
+            raise
+        return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._release()
+
+    def _release(self):
         for lock in reversed(self.acquired):
             lock.release()
         self.acquired.clear()
@@ -1,40 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor
 from random import choice, randint, shuffle
+from collections import OrderedDict, deque
+from eth_account import Account
 from cryptography.fernet import Fernet
 from base64 import urlsafe_b64encode
 from time import sleep, time
-from os import path, mkdir
+from os import path, mkdir, cpu_count
 from loguru import logger
 from hashlib import md5
+import threading
 import asyncio
-import json
 
 from .retry import DataBaseError
+from .storage import get_storage
+from .journal import ReportJournal
+from .session_cache import SessionCache
 from modules.utils import get_address, WindowName, sleeping
-from settings import SHUFFLE_WALLETS, BID_AMOUNTS
+from settings import SHUFFLE_WALLETS, BID_AMOUNTS, DB_ENGINE, DB_FLUSH, THREADS
 
 from cryptography.fernet import InvalidToken
 
 
+def prepare_wallets_chunk(chunk: list[tuple[str, str | None]], personal_key_raw: bytes):
+    personal_key = Fernet(personal_key_raw)
+    return [
+        (personal_key.encrypt(pk.encode()).decode(), Account.from_key(pk).address, proxy)
+        for pk, proxy in chunk
+    ]
+
+
 class DataBase:
     def __init__(self):
 
-        self.modules_db_name = 'databases/modules.json'
-        self.report_db_name = 'databases/report.json'
+        self.db_folder = 'databases'
+        self.report_db_name = f'{self.db_folder}/report.jsonl'
         self.personal_key = None
+        self.personal_key_raw = None
         self.window_name = None
 
+        self.decoded_pks = OrderedDict()  # LRU of decrypted privatekeys for currently running wallets
+        self.decoded_pks_limit = THREADS * 2
+
         self.changes_lock = asyncio.Lock()
+        self.compact_task = None
+
+        # changes are kept in memory and written to disk by background flusher
+        self.flush_lock = threading.Lock()
+        self.flush_event = asyncio.Event()
+        self.flush_task = None
+        self.mutations = 0
 
         # create db's if not exists
-        if not path.isdir(self.modules_db_name.split('/')[0]):
-            mkdir(self.modules_db_name.split('/')[0])
+        if not path.isdir(self.db_folder):
+            mkdir(self.db_folder)
 
-        for db_params in [
-            {"name": self.modules_db_name, "value": "[]"},
-            {"name": self.report_db_name, "value": "{}"},
-        ]:
-            if not path.isfile(db_params["name"]):
-                with open(db_params["name"], 'w') as f: f.write(db_params["value"])
+        self.storage = get_storage(engine=DB_ENGINE, db_folder=self.db_folder)
+        self.reports = ReportJournal(self.report_db_name)
+        self.reports.migrate_from_json(f'{self.db_folder}/report.json')
+        if self.reports.need_compact():
+            self.reports.compact()
+        self.sessions = SessionCache(f'{self.db_folder}/sessions.json')
 
         with open('input_data/proxies.txt') as f:
             self.proxies = [
@@ -61,20 +86,20 @@ class DataBase:
         sleep(0.2)
 
         password = md5(raw_password.encode()).hexdigest().encode()
-        self.personal_key = Fernet(urlsafe_b64encode(password))
+        self.personal_key_raw = urlsafe_b64encode(password)
+        self.personal_key = Fernet(self.personal_key_raw)
 
 
     def get_password(self):
         if self.personal_key is not None: return
 
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        if not modules_db: return
-
-        first_pk = list(modules_db.keys())[0]
+        first_pk = self.storage.first_encoded_pk()
         if not first_pk: return
         try:
-            temp_key = Fernet(urlsafe_b64encode(md5("@karamelniy dumb shit encrypting".encode()).hexdigest().encode()))
+            temp_key_raw = urlsafe_b64encode(md5("@karamelniy dumb shit encrypting".encode()).hexdigest().encode())
+            temp_key = Fernet(temp_key_raw)
             self.decode_pk(pk=first_pk, key=temp_key)
+            self.personal_key_raw = temp_key_raw
             self.personal_key = temp_key
             return
         except InvalidToken: pass
@@ -85,8 +110,10 @@ class DataBase:
                 raw_password = input("")
                 password = md5(raw_password.encode()).hexdigest().encode()
 
-                temp_key = Fernet(urlsafe_b64encode(password))
+                temp_key_raw = urlsafe_b64encode(password)
+                temp_key = Fernet(temp_key_raw)
                 self.decode_pk(pk=first_pk, key=temp_key)
+                self.personal_key_raw = temp_key_raw
                 self.personal_key = temp_key
                 logger.success(f'[+] Soft | Access granted!\n')
                 return
@@ -107,168 +134,277 @@ class DataBase:
         return key.decrypt(pk).decode()
 
 
+    def get_privatekey(self, encoded_pk: str):
+        if encoded_pk in self.decoded_pks:
+            self.decoded_pks.move_to_end(encoded_pk)
+            return self.decoded_pks[encoded_pk]
+
+        privatekey = self.decode_pk(pk=encoded_pk)
+        self.decoded_pks[encoded_pk] = privatekey
+        while len(self.decoded_pks) > self.decoded_pks_limit:
+            self.decoded_pks.popitem(last=False)
+        return privatekey
+
+
+    def release_privatekey(self, encoded_pk: str):
+        self.decoded_pks.pop(encoded_pk, None)
+
+
     def create_modules(self, mode: int):
-        self.set_password()
+        append_new = mode == 102
+        if append_new and self.storage.first_encoded_pk() is not None:
+            self.get_password()
+        else:
+            append_new = False
+            self.set_password()
 
-        with open('input_data/privatekeys.txt') as f:
-            privatekeys = f.read().splitlines()
         with open('input_data/proxies.txt') as f:
             proxies = f.read().splitlines()
 
         if len(proxies) == 0 or proxies == [""] or proxies == ["http://login:password@ip:port"]:
             logger.error('You will not use proxy')
-            proxies = [None for _ in range(len(privatekeys))]
-        else:
-            proxies = list(proxies * (len(privatekeys) // len(proxies) + 1))[:len(privatekeys)]
+            proxies = []
 
-        with open(self.report_db_name, 'w') as f: f.write('{}')  # clear report db
-
-        new_modules = {
-            self.encode_pk(pk): {
-                "address": get_address(pk),
-                "modules": [{"module_name": "opinion", "status": "to_run"} for _ in range(randint(*BID_AMOUNTS))],
-                "proxy": proxy,
-            }
-            for pk, proxy in zip(privatekeys, proxies)
-        }
+        if append_new:
+            known_addresses = self.storage.get_addresses()
+        else:
+            known_addresses = set()
+            self.storage.clear()
+            self.reports.reset()  # clear report db
+
+        added_wallets = 0
+        for wallets_chunk in self._prepare_wallets(proxies=proxies):
+            new_modules = {}
+            for encoded_pk, address, proxy in wallets_chunk:
+                if address in known_addresses: continue
+                known_addresses.add(address)
+                new_modules[encoded_pk] = {
+                    "address": address,
+                    "modules": [{"module_name": "opinion", "status": "to_run"} for _ in range(randint(*BID_AMOUNTS))],
+                    "proxy": proxy,
+                }
+            self.storage.insert_wallets(new_modules)
+            added_wallets += len(new_modules)
+        self.flush()
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(new_modules, f)
         amounts = self.get_amounts()
-        logger.info(f'Created Database for {amounts["accs_amount"]} accounts with {amounts["modules_amount"]} modules!\n')
+        if append_new:
+            logger.info(f'Added {added_wallets} new accounts to Database! Total {amounts["accs_amount"]} accounts with {amounts["modules_amount"]} modules\n')
+        else:
+            logger.info(f'Created Database for {amounts["accs_amount"]} accounts with {amounts["modules_amount"]} modules!\n')
+
+
+    def _prepare_wallets(self, proxies: list, chunk_size: int = 1000):
+        def _read_chunks():
+            chunk = []
+            keys_read = 0
+            with open('input_data/privatekeys.txt') as f:
+                for line in f:
+                    pk = line.strip()
+                    if not pk: continue
+                    chunk.append((pk, proxies[keys_read % len(proxies)] if proxies else None))
+                    keys_read += 1
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+
+        chunks = _read_chunks()
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return
+        elif len(first_chunk) < chunk_size:  # not worth to spawn processes for a few keys
+            yield prepare_wallets_chunk(first_chunk, self.personal_key_raw)
+            return
 
+        workers = cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque([executor.submit(prepare_wallets_chunk, first_chunk, self.personal_key_raw)])
+            for chunk in chunks:
+                pending.append(executor.submit(prepare_wallets_chunk, chunk, self.personal_key_raw))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
-    def get_amounts(self):
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-        modules_len = sum([len(modules_db[acc]["modules"]) for acc in modules_db])
 
-        for acc in modules_db:
-            for index, module in enumerate(modules_db[acc]["modules"]):
-                if module["status"] in ["failed", "cloudflare"]: modules_db[acc]["modules"][index]["status"] = "to_run"
+    def reset_failed_modules(self):
+        reset_amount = self.storage.reset_failed()
+        self.flush()
+        if reset_amount:
+            logger.info(f'Returned {reset_amount} failed modules to run\n')
+        return reset_amount
 
-        with open(self.modules_db_name, 'w', encoding="utf-8") as f:
-            json.dump(modules_db, f)
 
-        if self.window_name == None: self.window_name = WindowName(accs_amount=len(modules_db))
-        else: self.window_name.accs_amount = len(modules_db)
-        self.window_name.set_modules(modules_amount=modules_len)
+    def get_amounts(self):
+        amounts = self.storage.get_amounts()
+
+        if self.window_name == None: self.window_name = WindowName(accs_amount=amounts["accs_amount"])
+        else: self.window_name.accs_amount = amounts["accs_amount"]
+        self.window_name.set_modules(modules_amount=amounts["modules_amount"])
 
-        return {
-            'accs_amount': len(modules_db),
-            'modules_amount': modules_len,
-        }
+        return amounts
 
 
     def get_all_modules(self, unique_wallets: bool = False):
         self.get_password()
-        with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
-        if not modules_db:
+        if self.storage.first_encoded_pk() is None:
             return 'No more accounts left'
 
-        all_wallets_modules = [
-            {
-                'privatekey': self.decode_pk(pk=encoded_privatekey),
-                'encoded_privatekey': encoded_privatekey,
-                'proxy': wallet_data.get("proxy"),
-                'address': wallet_data["address"],
-                'module_info': module_info,
-                'last': module_index + 1 == len(modules_db[encoded_privatekey]["modules"])
-            }
-            for encoded_privatekey, wallet_data in modules_db.items()
-            for module_index, module_info in enumerate(modules_db[encoded_privatekey]["modules"])
-            if (
-                    module_info["status"] == "to_run" and
-                    (not unique_wallets or module_index + 1 == len(modules_db[encoded_privatekey]["modules"]))
-            )
-        ]
+        # only wallet keys are loaded here, modules of every wallet are read right before it starts
+        wallet_keys = self.storage.get_pending_wallets(unique_wallets=unique_wallets)
         if SHUFFLE_WALLETS:
-            shuffle(all_wallets_modules)
-        return all_wallets_modules
+            shuffle(wallet_keys)
+        return self._iter_wallets(wallet_keys, unique_wallets=unique_wallets)
+
+
+    def _iter_wallets(self, wallet_keys: list, unique_wallets: bool):
+        for wallet_key in wallet_keys:
+            wallet_modules = self.storage.get_modules(unique_wallets=unique_wallets, wallet_key=wallet_key)
+            if not wallet_modules:
+                continue
+
+            # modules of one wallet are run back to back in one session
+            yield {
+                "encoded_privatekey": wallet_modules[0]["encoded_privatekey"],
+                "proxy": wallet_modules[0]["proxy"],
+                "address": wallet_modules[0]["address"],
+                "modules": wallet_modules,
+            }
 
 
     async def remove_account(self, module_data: dict):
         async with self.changes_lock:
-            with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
             self.window_name.add_acc()
-            if module_data["module_info"]["status"] in [True, "completed"]:
-                del modules_db[module_data["encoded_privatekey"]]
-            else:
-                modules_db[module_data["encoded_privatekey"]]["modules"] = [
-                    {**module, "status": "failed"}
-                    for module in modules_db[module_data["encoded_privatekey"]]["modules"]
-                ]
-
-            with open(self.modules_db_name, 'w', encoding="utf-8") as f:
-                json.dump(modules_db, f)
+            self.storage.finish_account(
+                encoded_pk=module_data["encoded_privatekey"],
+                completed=module_data["module_info"]["status"] in [True, "completed"],
+            )
+            self.changed()
 
 
     async def remove_module(self, module_data: dict):
         async with self.changes_lock:
-            with open(self.modules_db_name, encoding="utf-8") as f: modules_db = json.load(f)
-
-            for index, module in enumerate(modules_db[module_data["encoded_privatekey"]]["modules"]):
-                if module["module_name"] == module_data["module_info"]["module_name"] and module["status"] == "to_run":
-                    self.window_name.add_module()
-
-                    if module_data["module_info"]["status"] in [True, "completed"]:
-                        modules_db[module_data["encoded_privatekey"]]["modules"].remove(module)
-                    else:
-                        modules_db[module_data["encoded_privatekey"]]["modules"][index]["status"] = "failed"
-                    break
-
-            if [
-                module["status"]
-                for module in modules_db[module_data["encoded_privatekey"]]["modules"]
-            ].count('to_run') == 0:
+            found, to_run_left = self.storage.finish_module(
+                encoded_pk=module_data["encoded_privatekey"],
+                module_name=module_data["module_info"]["module_name"],
+                module_id=module_data.get("module_id"),
+                completed=module_data["module_info"]["status"] in [True, "completed"],
+            )
+            self.changed()
+            if found:
+                self.window_name.add_module()
+
+            if to_run_left == 0:
                 self.window_name.add_acc()
                 last_module = True
             else:
                 last_module = False
 
-            if not modules_db[module_data["encoded_privatekey"]]["modules"]:
-                del modules_db[module_data["encoded_privatekey"]]
-
-            with open(self.modules_db_name, 'w', encoding="utf-8") as f: json.dump(modules_db, f)
             return last_module
 
 
     async def append_report(self, encoded_pk: str, text: str, success: bool = None):
         async with self.changes_lock:
-            status_smiles = {True: '✅ ', False: "❌ ", None: ""}
+            self.reports.append(encoded_pk=encoded_pk, text=text, success=success)
+            self.changed()
 
-            with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
 
-            if not report_db.get(encoded_pk): report_db[encoded_pk] = {'texts': [], 'success_rate': [0, 0]}
+    async def get_account_reports(self, encoded_pk: str, address: str = None, get_rate: bool = False):
+        async with self.changes_lock:
+            account_reports = self.reports.read(encoded_pk=encoded_pk)
 
-            report_db[encoded_pk]["texts"].append(status_smiles[success] + text)
-            if success != None:
-                report_db[encoded_pk]["success_rate"][1] += 1
-                if success == True: report_db[encoded_pk]["success_rate"][0] += 1
+            if address is None:
+                address = get_address(pk=self.decode_pk(pk=encoded_pk))
+            account_index = f"[{self.window_name.accs_done}/{self.window_name.accs_amount}]"
 
-            with open(self.report_db_name, 'w') as f: json.dump(report_db, f)
+            if account_reports:
+                success_rate = [
+                    len([report for report in account_reports if report["success"] == True]),
+                    len([report for report in account_reports if report["success"] != None]),
+                ]
+                if get_rate: return f'{success_rate[0]}/{success_rate[1]}'
+                self.reports.clear(encoded_pk=encoded_pk)
+                self.changed()
+                self.schedule_compact()
 
+                logs_text = '\n'.join([report["text"] for report in account_reports])
+                tg_text = f'{account_index} <b>{address}</b>\n\n{logs_text}'
+                if success_rate[1]:
+                    tg_text += f'\n\nSuccess rate {success_rate[0]}/{success_rate[1]}'
 
-    async def get_account_reports(self, encoded_pk: str, get_rate: bool = False):
-        async with self.changes_lock:
-            with open(self.report_db_name, encoding="utf-8") as f: report_db = json.load(f)
+                return tg_text
 
-            decoded_privatekey = self.decode_pk(pk=encoded_pk)
-            account_index = f"[{self.window_name.accs_done}/{self.window_name.accs_amount}]"
+            else:
+                return f'{account_index} <b>{address}</b>\n\nNo actions'
 
-            if report_db.get(encoded_pk):
-                account_reports = report_db[encoded_pk]
-                if get_rate: return f'{account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
-                del report_db[encoded_pk]
 
-                with open(self.report_db_name, 'w', encoding="utf-8") as f: json.dump(report_db, f)
+    def get_session(self, address: str):
+        return self.sessions.get(address, personal_key=self.personal_key)
 
-                logs_text = '\n'.join(account_reports['texts'])
-                tg_text = f'{account_index} <b>{get_address(pk=decoded_privatekey)}</b>\n\n{logs_text}'
-                if account_reports["success_rate"][1]:
-                    tg_text += f'\n\nSuccess rate {account_reports["success_rate"][0]}/{account_reports["success_rate"][1]}'
 
-                return tg_text
+    def save_session(self, address: str, session: dict):
+        self.sessions.set(address, session, personal_key=self.personal_key)
+        self.changed()
 
-            else:
-                return f'{account_index} <b>{get_address(pk=decoded_privatekey)}</b>\n\nNo actions'
+
+    def schedule_compact(self):
+        if not self.reports.need_compact() or (self.compact_task and not self.compact_task.done()):
+            return
+
+        def _compact():
+            with self.flush_lock:
+                self.reports.compact()
+
+        async def _compact_task():
+            async with self.changes_lock:
+                await asyncio.to_thread(_compact)
+
+        self.compact_task = asyncio.create_task(_compact_task())
+
+
+    def changed(self):
+        self.mutations += 1
+        if self.mutations >= DB_FLUSH["mutations"]:
+            self.flush_event.set()
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flusher())
+
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=DB_FLUSH["interval"] / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+
+            if self.mutations:
+                try:
+                    async with self.changes_lock:
+                        await asyncio.to_thread(self.flush)
+                except Exception as err:  # keep flushing, changes stay dirty and are written on next try
+                    logger.error(f'[-] Database | Failed to save changes: {err}')
+
+
+    def flush(self):
+        with self.flush_lock:
+            mutations, self.mutations = self.mutations, 0
+            try:
+                self.storage.flush()
+                self.reports.flush()
+                self.sessions.flush()
+            except Exception:
+                self.mutations += mutations
+                raise
+
+
+    async def close(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+            try: await self.flush_task
+            except asyncio.CancelledError: pass
+
+        async with self.changes_lock:
+            self.flush()
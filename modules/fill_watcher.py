@@ -0,0 +1,98 @@
+from collections import defaultdict
+from contextlib import aclosing
+import asyncio
+
+from settings import FILL_CHECK_INTERVAL
+
+
+class FillWatcher:
+    def __init__(self, browser):
+        self.browser = browser
+
+        # orders are polled in groups with same `get_orders` params: (order_type, topic_id, is_parent)
+        self.waiters: dict[tuple, dict[str, asyncio.Future]] = defaultdict(dict)
+        self.pollers: dict[tuple, asyncio.Task] = {}
+
+
+    def watch(self, trans_no: str, order_type: str, topic_id: int = None, is_parent: bool = None):
+        group = (order_type, topic_id, is_parent)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[group][trans_no] = future
+
+        if group not in self.pollers or self.pollers[group].done():
+            self.pollers[group] = asyncio.create_task(self._poll(group))
+        return future
+
+
+    def forget(self, trans_no: str):
+        for group_waiters in self.waiters.values():
+            future = group_waiters.pop(trans_no, None)
+            if future and not future.done():
+                future.cancel()
+
+
+    async def close(self):
+        for group_waiters in self.waiters.values():
+            for future in group_waiters.values():
+                future.cancel()
+        self.waiters.clear()
+
+        for poller in self.pollers.values():
+            poller.cancel()
+        await asyncio.gather(*self.pollers.values(), return_exceptions=True)
+        self.pollers.clear()
+
+
+    async def _poll(self, group: tuple):
+        order_type, topic_id, is_parent = group
+        interval = FILL_CHECK_INTERVAL[0]
+        last_state = None
+
+        while self.waiters.get(group):
+            group_waiters = self.waiters[group]
+            orders = {}
+            try:
+                async with aclosing(self.browser.iter_orders(
+                    order_type=order_type,
+                    topic_id=topic_id,
+                    is_parent=is_parent,
+                    prefetch=False,
+                )) as all_orders:
+                    async for order in all_orders:
+                        orders[order["transNo"]] = order
+                        if all(trans_no in orders for trans_no in group_waiters):  # dont load older pages
+                            break
+            except Exception as err:
+                for future in self.waiters.pop(group, {}).values():
+                    if not future.done(): future.set_exception(err)
+                return
+
+            for trans_no, future in list(group_waiters.items()):
+                order = orders.get(trans_no)
+                if future.done():
+                    del group_waiters[trans_no]
+                elif order is None:
+                    del group_waiters[trans_no]
+                    future.set_exception(Exception(f'Failed to found order {trans_no}'))
+                elif self.is_filled(order):
+                    del group_waiters[trans_no]
+                    future.set_result(order)
+
+            # poll faster while orders are changing, back off while nothing happens
+            state = [orders[trans_no]["filled"] for trans_no in group_waiters if trans_no in orders]
+            if state != last_state:
+                interval = FILL_CHECK_INTERVAL[0]
+            else:
+                interval = min(interval * 1.5, FILL_CHECK_INTERVAL[1])
+            last_state = state
+
+            if group_waiters:
+                await asyncio.sleep(interval)
+
+        self.waiters.pop(group, None)
+
+
+    @classmethod
+    def is_filled(cls, order: dict):
+        filled, total = order["filled"].split('/')
+        return round(float(filled), 2) == round(float(total), 2)
@@ -0,0 +1,136 @@
+from collections import defaultdict
+from os import path, replace, remove, fsync
+
+from modules.utils import json_loads, json_dumps
+
+
+class ReportJournal:
+    STATUS_SMILES = {True: '✅ ', False: "❌ ", None: ""}
+    MIN_COMPACT_LINES = 1000    # dont compact small journals, rewriting them costs more than reading dead lines
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+        self.index: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        self.dead_lines = 0
+        self.dirty = False
+
+        if not path.isfile(self.file_name):
+            open(self.file_name, 'wb').close()
+        self._build_index()
+        self.journal = open(self.file_name, 'ab')
+
+
+    def _build_index(self):
+        self.index.clear()
+        self.dead_lines = 0
+
+        offset = 0
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):    # half-written line after crash
+                    break
+                entry = json_loads(line)
+                if entry.get("clear"):
+                    self.dead_lines += len(self.index.pop(entry["pk"], [])) + 1
+                else:
+                    self.index[entry["pk"]].append((offset, len(line)))
+                offset += len(line)
+
+        if offset != path.getsize(self.file_name):
+            with open(self.file_name, 'r+b') as f: f.truncate(offset)
+
+
+    def _write(self, entry: dict):
+        line = json_dumps(entry) + b"\n"
+        offset = self.journal.tell()
+        self.journal.write(line)
+        self.dirty = True
+        return offset, len(line)
+
+
+    def flush(self, sync: bool = True):
+        if not self.dirty: return
+        self.journal.flush()
+        if sync:
+            fsync(self.journal.fileno())
+            self.dirty = False
+
+
+    def append(self, encoded_pk: str, text: str, success: bool = None):
+        self.index[encoded_pk].append(self._write({
+            "pk": encoded_pk,
+            "text": self.STATUS_SMILES[success] + text,
+            "success": success,
+        }))
+
+
+    def read(self, encoded_pk: str):
+        entries = []
+        if not self.index.get(encoded_pk):
+            return entries
+
+        self.flush(sync=False)
+        with open(self.file_name, 'rb') as f:
+            for offset, length in self.index[encoded_pk]:
+                f.seek(offset)
+                entries.append(json_loads(f.read(length)))
+        return entries
+
+
+    def clear(self, encoded_pk: str):
+        if encoded_pk not in self.index: return
+        self.dead_lines += len(self.index.pop(encoded_pk)) + 1
+        self._write({"pk": encoded_pk, "clear": True})
+
+
+    def reset(self):
+        self.dirty = False
+        self.journal.close()
+        open(self.file_name, 'wb').close()
+        self._build_index()
+        self.journal = open(self.file_name, 'ab')
+
+
+    def need_compact(self):
+        live_lines = sum(len(entries) for entries in self.index.values())
+        return self.dead_lines >= self.MIN_COMPACT_LINES and self.dead_lines > live_lines
+
+
+    def compact(self):
+        self.flush()
+        temp_name = self.file_name + ".tmp"
+        new_index = defaultdict(list)
+
+        offset = 0
+        with open(self.file_name, 'rb') as src, open(temp_name, 'wb') as dst:
+            for encoded_pk, entries in self.index.items():
+                for entry_offset, length in entries:
+                    src.seek(entry_offset)
+                    dst.write(src.read(length))
+                    new_index[encoded_pk].append((offset, length))
+                    offset += length
+            dst.flush()
+            fsync(dst.fileno())
+
+        self.journal.close()
+        replace(temp_name, self.file_name)
+        self.index = new_index
+        self.dead_lines = 0
+        self.journal = open(self.file_name, 'ab')
+
+
+    def migrate_from_json(self, file_name: str):
+        if not path.isfile(file_name):
+            return
+
+        with open(file_name, 'rb') as f: report_db = json_loads(f.read())
+        for encoded_pk, account_reports in report_db.items():
+            for text in account_reports["texts"]:
+                success = next((
+                    status for status, smile in self.STATUS_SMILES.items()
+                    if smile and text.startswith(smile)
+                ), None)
+                self.index[encoded_pk].append(self._write({"pk": encoded_pk, "text": text, "success": success}))
+        self.flush()
+        remove(file_name)
@@ -0,0 +1,43 @@
+from contextlib import asynccontextmanager
+from collections import defaultdict
+from time import monotonic
+
+
+class LatencyStats:
+    def __init__(self):
+        self.stats = defaultdict(lambda: {"calls": 0, "total": 0.0, "max": 0.0})
+
+
+    def record(self, step: str, duration: float):
+        step_stats = self.stats[step]
+        step_stats["calls"] += 1
+        step_stats["total"] += duration
+        step_stats["max"] = max(step_stats["max"], duration)
+
+
+    @asynccontextmanager
+    async def measure(self, step: str):
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            self.record(step, monotonic() - started_at)
+
+
+    async def timed(self, step: str, coro):
+        async with self.measure(step):
+            return await coro
+
+
+    def get_metrics(self):
+        return {
+            step: {
+                "calls": step_stats["calls"],
+                "avg": round(step_stats["total"] / step_stats["calls"], 3),
+                "max": round(step_stats["max"], 3),
+            }
+            for step, step_stats in self.stats.items()
+        }
+
+
+latency_stats = LatencyStats()
@@ -1,15 +1,19 @@
-from random import uniform, randint, random, choice
+from random import uniform, randint, choice
 from datetime import datetime, timezone
-from decimal import Decimal
-from loguru import logger
 from time import time
+from loguru import logger
 import asyncio
 
-from modules.retry import CustomError, retry, TransactionError
+from modules.retry import CustomError, retry, TransactionError, TokenRejected
 from modules.utils import round_cut, async_sleep, make_border
+from modules.order_lifecycle import OrderLifecycle
+from modules.account_state import AccountState
+from modules.session_cache import get_token_expiry
+from modules.latency_stats import latency_stats
+from modules.order_signer import OrderSigner
 from modules.browser import Browser
 from modules.wallet import Wallet
-from settings import BID_SETTINGS, SLEEP_BETWEEN_ORDERS, BID_TYPES, LIMIT_SETTINGS
+from settings import BID_SETTINGS, SLEEP_BETWEEN_ORDERS, BID_TYPES, LIMIT_SETTINGS, SELL_ALL_PARALLEL, SESSION_CACHE
 
 
 class Opinion:
@@ -43,35 +47,141 @@ class Opinion:
         },
     }
 
+    ORDER_SIGNER = OrderSigner(TYPED_DATA)
+
     def __init__(self, wallet: Wallet, browser: Browser):
         self.wallet = wallet
         self.browser = browser
 
-        self.profile_info = None
-        self.proxy_wallet = None
+        self.account = AccountState(browser)
+        self.logged_in = False
+        self.browser.relogin = self.relogin
+
+
+    @property
+    def proxy_wallet(self):
+        return self.account.proxy_wallet
 
 
     @retry(source="Opinion")
     async def run(self, mode: int):
         status = None
-        await self.login()
+        try:
+            await self.login()
+
+            if mode == 1:
+                status = await self.buy_sell_position()
+
+            elif mode == 2:
+                status = await self.sell_all()
 
-        if mode == 1:
-            status = await self.buy_sell_position()
+            elif mode == 3:
+                status = await self.parse()
 
-        elif mode == 2:
-            status = await self.sell_all()
+        except TokenRejected:
+            self._drop_token()  # next retry will make full login
+            self.account.invalidate()
+            raise
 
-        elif mode == 3:
-            status = await self.parse()
+        except Exception:
+            # failed step may have placed or filled an order - dont size next retry from old balance
+            self.account.invalidate()
+            raise
 
         return status
 
 
     async def login(self):
-        if not await self.browser.is_user_registered():
-            raise CustomError("User is not registered")
+        if self.logged_in:  # same session is reused for all modules of wallet
+            return
+
+        self.browser.logging_in = True  # 401 during login is handled here, not by `relogin`
+        try:
+            await self._login()
+        finally:
+            self.browser.logging_in = False
+
+
+    async def relogin(self):
+        self.log_message("Login expired, logging in again")
+        self._drop_token()
+        await self.login()
+
+
+    async def _login(self):
+        async with latency_stats.measure("login"):
+            stored_session = self.wallet.db.get_session(self.wallet.address) if SESSION_CACHE["enabled"] else {}
+            session = stored_session
+
+            # token must live long enough for all modules of wallet
+            if session.get("token") and session["expires_at"] > time() + SESSION_CACHE["min_token_left"] * 60:
+                self.browser.set_token(session["token"])
+                try:
+                    await latency_stats.timed("login: profile", self.account.get_profile_info(fresh=True))
+                    await self._check_proxy_wallet(session)
+                    self._save_session(session, stored_session)
+                    self.logged_in = True
+                    return
+                except TokenRejected:
+                    self.log_message("Saved login expired, logging in again")
+                    self.browser.set_token(None)
+                    session = {**session, "token": None}
+
+            # registration check and SIWE signature dont depend on each other
+            is_registered, (sign_message, signature, date_now, nonce) = await asyncio.gather(
+                latency_stats.timed("login: is registered", self._is_user_registered(session)),
+                latency_stats.timed("login: sign", self._sign_login_message()),
+            )
+            if not is_registered:
+                raise CustomError("User is not registered")
+
+            token = await latency_stats.timed("login: user login", self.browser.user_login(
+                sign_message,
+                signature,
+                int(date_now.timestamp()),
+                nonce,
+            ))
+            session = {**session, "registered": True, "token": token, "expires_at": get_token_expiry(token)}
 
+            await latency_stats.timed("login: profile", self.account.get_profile_info(fresh=True))
+            await self._check_proxy_wallet(session)
+            self._save_session(session, stored_session)
+            self.logged_in = True
+
+
+    async def _is_user_registered(self, session: dict):
+        if session.get("registered"):
+            return True
+        return await self.browser.is_user_registered()
+
+
+    async def _check_proxy_wallet(self, session: dict):
+        if not self.proxy_wallet:
+            raise CustomError(f'No proxy wallet created')
+
+        # approval is cached only for the same proxy wallet and only once it is approved
+        if not (session.get("approved") and session.get("proxy_wallet") == self.proxy_wallet):
+            if not await latency_stats.timed("login: is approved", self.browser.is_approved(self.proxy_wallet)):
+                raise CustomError("Wallet is not approved")
+
+
+    def _save_session(self, session: dict, stored_session: dict):
+        # compared with session as it was loaded from disk, so new token is always written
+        new_session = {**session, "proxy_wallet": self.proxy_wallet, "approved": True}
+        if SESSION_CACHE["enabled"] and new_session != stored_session:
+            self.wallet.db.save_session(self.wallet.address, new_session)
+
+
+    def _drop_token(self):
+        if SESSION_CACHE["enabled"]:
+            session = self.wallet.db.get_session(self.wallet.address)
+            if session.get("token"):
+                self.wallet.db.save_session(self.wallet.address, {**session, "token": None})
+        self.browser.set_token(None)
+        self.logged_in = False
+
+
+    async def _sign_login_message(self):
         date_now = datetime.now(timezone.utc)
         nonce = randint(65535, 0xffffffffffff)
         sign_message = f"""app.opinion.trade wants you to sign in with your Ethereum account:
@@ -84,21 +194,8 @@ Version: 1
 Chain ID: 56
 Nonce: {nonce}
 Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
-        signature = self.wallet.sign_message(sign_message).removeprefix("0x")
-
-        await self.browser.user_login(
-            sign_message,
-            signature,
-            int(date_now.timestamp()),
-            nonce,
-        )
-
-        self.profile_info = await self.browser.get_profile_info()
-        self.proxy_wallet = self.profile_info["multiSignedWalletAddress"].get("56")
-        if not self.proxy_wallet:
-            raise CustomError(f'No proxy wallet created')
-        elif not await self.browser.is_approved(self.proxy_wallet):
-            raise CustomError("Wallet is not approved")
+        signature = (await self.wallet.sign_message_async(sign_message)).removeprefix("0x")
+        return sign_message, signature, date_now, nonce
 
 
     async def buy_sell_position(self):
@@ -127,11 +224,11 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
 
 
     async def sell_all(self):
-        sold_any = False
+        semaphore = asyncio.Semaphore(SELL_ALL_PARALLEL)
 
-        open_orders = await self.browser.get_orders(order_type="limit")
-        for open_order in open_orders:
-            await self.browser.cancel_order(open_order["transNo"])
+        async def cancel_order(open_order: dict):
+            async with semaphore:
+                await self.browser.cancel_order(open_order["transNo"])
             pos_name = f'{open_order["mutilTitle"]} {open_order["topicTitle"]}' if open_order["mutilTitle"] else open_order["topicTitle"]
             self.log_message(f'Cancelled order in "{pos_name}"', level="INFO")
             await self.wallet.db.append_report(
@@ -139,18 +236,24 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
                 text=f'cancel order "{pos_name}"',
                 success=True,
             )
-            sold_any = True
 
-        positions = await self.browser.get_position()
-        for position in positions:
-            if float(position["value"]) >= 1:
+        async def sell_position(position: dict):
+            async with semaphore:
                 await self.create_order(
                     order_side="sell",
                     order_type=choice(BID_TYPES["close"]),
                     position=position,
                 )
-                sold_any = True
 
+        open_orders = await self.browser.get_orders(order_type="limit")
+        await self._gather_all([cancel_order(open_order) for open_order in open_orders])
+        if open_orders:
+            self.account.invalidate()
+
+        positions = [position for position in await self.account.get_positions() if float(position["value"]) >= 1]
+        await self._gather_all([sell_position(position) for position in positions])
+
+        sold_any = bool(open_orders or positions)
         if not sold_any:
             self.log_message(f"No positions found to sell", level="INFO")
             await self.wallet.db.append_report(
@@ -163,12 +266,13 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
 
 
     async def parse(self):
-        balance = round(float(self.profile_info["balance"][0]["balance"]), 2)
-        profit = round(float(self.profile_info["totalProfit"]), 2)
-        volume = round(float(self.profile_info["Volume"]), 2)
+        profile_info = await self.account.get_profile_info()
+        balance = round(float(profile_info["balance"][0]["balance"]), 2)
+        profit = round(float(profile_info["totalProfit"]), 2)
+        volume = round(float(profile_info["Volume"]), 2)
 
         positions, rank = await asyncio.gather(*[
-            self.browser.get_position(),
+            self.account.get_positions(),
             self.browser.get_rank(),
         ])
         total_positions = len([p for p in positions if float(p["value"]) >= 1])
@@ -203,173 +307,27 @@ Issued At: {date_now.isoformat()[:-9] + 'Z'}"""
             order: dict = None,
             position: dict = None,
     ):
-        if order_side == "buy":
-            side = 0
-            if not event:
-                event = await self.browser.get_events()
-                if not event:
-                    raise Exception(f'No events found')
-
-            amount = float(await self.calculate_order_amount())
-            usd_amount = amount
-            if event.get("force_vote"):
-                event_choice_index = event["force_vote"] - 1
-            else:
-                event_choice_index = choice([0, 1])
-            token_id = event["tokens"][event_choice_index]
-            label = event["labels"][event_choice_index]
-
-            action_name = "Bidding"
-
-        elif order_side == "sell":
-            side = 1
-            if position:
-                event_choice_index = position["outcomeSide"] - 1
-                label = position["outcome"]
-                event = await self.browser.get_events(
-                    event_to_find={
-                        "link": f"?topicId={position['mutilTopicId'] or position['topicId']}{'&type=multi' if position['mutilTopicId'] else ''}",
-                        "event_name": position["topicTitle"],
-                        "vote": position["outcomeSide"],
-                    },
-                )
-
-            elif order and event:
-                event_choice_index = order["outcomeSide"] - 1
-                position = await self.browser.get_position(
-                    topic_id=event["raw_event"]["topicId"],
-                    outcome_side=order["outcomeSide"]
-                )
-                if not position:
-                    raise Exception(f'Failed to found active position "{event["name"]}"')
-
-                label = event["labels"][event_choice_index]
-
-            else:
-                raise Exception(f'One of `position` or `order` & `event` must be provided for sell')
-
-            amount = float(round_cut(position["tokenAmount"], 2))
-            usd_amount = round_cut(position["value"], 2)
-
-            token_id = position["tokenId"]
-
-            action_name = "Selling"
+        return await OrderLifecycle(
+            opinion=self,
+            order_side=order_side,
+            order_type=order_type,
+            event=event,
+            order=order,
+            position=position,
+        ).run()
 
-        else:
-            raise Exception(f'Unsupported order_side: `{order_side}`')
-
-        book = await self.browser.get_event_book(
-            question_id=event["raw_event"]["questionId"],
-            symbol=event["raw_event"]["yesPos" if event_choice_index == 0 else "noPos"],
-            event_choice_index=event_choice_index,
-        )
-        if order_type == "market":
-            price = book["asks" if order_side == "buy" else "bids"][0]
-            taker_amount = 0
-
-        elif order_type == "limit":
-            price = self._calculate_limit_price(order_side, book)
-
-            if order_side == "buy":
-                taker_amount = float(round_cut(amount / price, 2))
-                amount = float(Decimal(str(taker_amount)) * Decimal(str(price)))
-            else:
-                taker_amount = float(Decimal(str(amount)) * Decimal(str(price)))
-
-        else:
-            raise CustomError(f'Unsupported order type `{order_type}`')
-
-        typed_data = self.TYPED_DATA.copy()
-        typed_data["message"].update({
-            "salt": str(int(random() * int(time() * 1e3))),
-            "maker": self.proxy_wallet,
-            "signer": self.wallet.address,
-            "tokenId": token_id,
-            "makerAmount": str(int(Decimal(str(amount)) * Decimal('1e18'))),
-            "takerAmount": str(int(Decimal(str(taker_amount)) * Decimal('1e18'))),
-            "side": str(side),
-        })
-        signature = self.wallet.sign_message(typed_data=typed_data)
 
-        self.log_message(
-            f'{action_name} <green>{usd_amount} USDT</green> for {label} in <blue>{event["name"]}</blue> <green>at {round(price * 100, 2)}¢</green>',
-            level="INFO"
-        )
-        order_data = await self.browser.create_order(
-            typed_message=typed_data["message"],
-            signature=signature,
-            event_id=event["raw_event"]["topicId"],
-            safe_rate="0" if (order_side == "buy" and order_type == "market") else "0.05",
-            price=str(price) if order_type == "limit" else "0"
-        )
-
-        if order_type == "limit":
-            to_wait_sec = LIMIT_SETTINGS[f"to_wait_{order_side}"] * 60
-            deadline_ts = int(time()) + to_wait_sec
-            minutes_str = f"{LIMIT_SETTINGS[f'to_wait_{order_side}']} minute{'s' if LIMIT_SETTINGS[f'to_wait_{order_side}'] > 1 else ''}"
-        else:
-            minutes_str = ""
-
-        self.log_message(f"Waiting for {order_type} {order_side} order filled" + (f" {minutes_str}" if minutes_str else ""))
-        while True:
-            filled_order = await self.browser.get_orders(
-                topic_id=event["raw_event"]["topicId"],
-                trans_no=order_data["transNo"],
-                is_parent=event["is_child"],
-                order_type=order_type,
-            )
-            if filled_order is None:
-                raise Exception(f'Failed to found order {order_data["transNo"]}')
-
-            if round(float(filled_order["filled"].split('/')[0]), 2)  == round(float(filled_order["filled"].split('/')[1]), 2):
-                final_price = round(float(filled_order["price"]) * 100, 2)
-                total_price = round_cut(filled_order["totalPrice"], 2)
-                self.log_message(f"Filled {order_type} {order_side} order for <green>{total_price}$ at {final_price}¢</green>", level="INFO")
-                await self.wallet.db.append_report(
-                    encoded_pk=self.wallet.encoded_pk,
-                    text=f"{order_type} {order_side} «{label}» for {usd_amount}$ at {final_price}¢ in {event['name']}",
-                    success=True
-                )
-                break
-
-            elif order_type == "limit":
-                if time() > deadline_ts:
-                    book = await self.browser.get_event_book(
-                        question_id=event["raw_event"]["questionId"],
-                        symbol=event["raw_event"]["yesPos" if event_choice_index == 0 else "noPos"],
-                        event_choice_index=event_choice_index,
-                    )
-                    if price == self._calculate_limit_price(order_side, book):
-                        self.log_message(f"Limit order not filled in {minutes_str}, but price not changed, waiting again...")
-                        deadline_ts = int(time()) + to_wait_sec
-                    else:
-                        self.log_message(f"Limit order not filled in {minutes_str}, changing price...")
-
-                        await self.browser.cancel_order(order_data["transNo"])
-                        self.log_message(f'Cancelled order in "{event["name"]}"', level="INFO")
-
-                        if order_side == "buy":
-                            event["force_vote"] = event_choice_index + 1
-
-                        return await self.create_order(
-                                order_side=order_side,
-                                order_type=order_type,
-                                event=event,
-                                order=order,
-                                position=position,
-                        )
-
-            await async_sleep(3)
-
-        return {
-            "order": filled_order,
-            "event": event,
-        }
+    @classmethod
+    async def _gather_all(cls, tasks: list):
+        # let every order finish (and write its report) before failing on the first error
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
 
     async def get_balance(self):
-        profile_info = await self.browser.get_profile_info()
-        return float(profile_info["balance"][0]["balance"])
+        return await self.account.get_balance()
 
 
     async def calculate_order_amount(self):
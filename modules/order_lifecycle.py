@@ -0,0 +1,299 @@
+from random import random, choice
+from decimal import Decimal
+from time import time, monotonic
+import asyncio
+
+from modules.fill_watcher import FillWatcher
+from modules.retry import CustomError
+from modules.utils import round_cut
+from settings import LIMIT_SETTINGS
+
+
+class OrderLifecycle:
+    # prepare -> (place -> watch -> cancel)* -> filled
+    # everything computed in `prepare` is kept between reprices, only price is taken again from fresh book
+    def __init__(
+            self,
+            opinion,
+            order_side: str,
+            order_type: str,
+            event: dict = None,
+            order: dict = None,
+            position: dict = None,
+    ):
+        self.opinion = opinion
+        self.browser = opinion.browser
+        self.wallet = opinion.wallet
+
+        self.order_side = order_side
+        self.order_type = order_type
+        self.event = event
+        self.order = order
+        self.position = position
+
+        self.reprices = 0
+        self.exhausted = False
+        self.order_data = None  # placed order which is not filled or cancelled yet
+        self.transitions: list[tuple[str, float]] = []
+
+
+    async def run(self):
+        if self.order_type == "limit":
+            self.to_wait_sec = LIMIT_SETTINGS[f"to_wait_{self.order_side}"] * 60
+            self.total_deadline = time() + LIMIT_SETTINGS["max_total_wait"] * 60
+            self.minutes_str = f"{LIMIT_SETTINGS[f'to_wait_{self.order_side}']} minute{'s' if LIMIT_SETTINGS[f'to_wait_{self.order_side}'] > 1 else ''}"
+        else:
+            self.minutes_str = ""
+
+        try:
+            await self._transition("prepare", self.prepare)
+            while True:
+                await self._transition("place", self.place)
+                filled_order = await self._transition("watch", self.watch)
+                if filled_order:
+                    self.order_data = None
+                    self.opinion.account.invalidate()
+                    break
+
+                final_order = await self._transition("cancel", self.cancel)
+                if final_order and FillWatcher.is_filled(final_order):  # filled right before cancel
+                    filled_order = final_order
+                    break
+
+                if self.exhausted:
+                    if self.order_side == "buy":
+                        raise CustomError(f'Limit buy order not filled after {self.reprices} reprices')
+                    # never leave bought position unsold - close it by market
+                    self.opinion.log_message(f"Limit sell order not filled after {self.reprices} reprices, selling by market")
+                    self.order_type = "market"
+                    self.minutes_str = ""
+                    self.exhausted = False
+
+                self.reprices += 1
+                # amounts are taken again if part of cancelled order was filled (or its final state is unknown)
+                if not final_order or float(final_order["filled"].split('/')[0]) or self.order_type == "market":
+                    await self._transition("refresh", self.refresh_amount)
+
+        except BaseException:
+            if self.order_data:
+                await self._cancel_after_error()
+            raise
+
+        finally:
+            self.opinion.log_message(
+                "Order lifecycle: " + " → ".join(f"{name} {duration}s" for name, duration in self.transitions)
+            )
+
+        final_price = round(float(filled_order["price"]) * 100, 2)
+        total_price = round_cut(filled_order["totalPrice"], 2)
+        self.opinion.log_message(f"Filled {self.order_type} {self.order_side} order for <green>{total_price}$ at {final_price}¢</green>", level="INFO")
+        await self.wallet.db.append_report(
+            encoded_pk=self.wallet.encoded_pk,
+            text=f"{self.order_type} {self.order_side} «{self.label}» for {self.usd_amount}$ at {final_price}¢ in {self.event['name']}",
+            success=True
+        )
+
+        return {
+            "order": filled_order,
+            "event": self.event,
+        }
+
+
+    async def _transition(self, name: str, step):
+        started_at = monotonic()
+        try:
+            return await step()
+        finally:
+            self.transitions.append((name, round(monotonic() - started_at, 2)))
+
+
+    async def prepare(self):
+        if self.order_side == "buy":
+            self.side = 0
+            if not self.event:
+                self.event = await self.browser.get_events()
+                if not self.event:
+                    raise Exception(f'No events found')
+
+            if self.event.get("force_vote"):
+                self.event_choice_index = self.event["force_vote"] - 1
+            else:
+                self.event_choice_index = choice([0, 1])
+            self.token_id = self.event["tokens"][self.event_choice_index]
+            self.label = self.event["labels"][self.event_choice_index]
+
+            self.action_name = "Bidding"
+
+        elif self.order_side == "sell":
+            self.side = 1
+            if self.position:
+                self.event_choice_index = self.position["outcomeSide"] - 1
+                self.label = self.position["outcome"]
+                self.event = await self.browser.get_events(
+                    event_to_find={
+                        "link": f"?topicId={self.position['mutilTopicId'] or self.position['topicId']}{'&type=multi' if self.position['mutilTopicId'] else ''}",
+                        "event_name": self.position["topicTitle"],
+                        "vote": self.position["outcomeSide"],
+                    },
+                )
+
+            elif self.order and self.event:
+                self.event_choice_index = self.order["outcomeSide"] - 1
+                self.label = self.event["labels"][self.event_choice_index]
+                self.position = None
+
+            else:
+                raise Exception(f'One of `position` or `order` & `event` must be provided for sell')
+
+            self.token_id = self.position["tokenId"] if self.position else None
+            self.action_name = "Selling"
+
+        else:
+            raise Exception(f'Unsupported order_side: `{self.order_side}`')
+
+        await self.refresh_amount()
+
+
+    async def refresh_amount(self):
+        if self.order_side == "buy":
+            self.amount = float(await self.opinion.calculate_order_amount())
+            self.usd_amount = self.amount
+
+        else:
+            if not self.position or self.reprices:
+                self.position = await self.opinion.account.get_position(
+                    topic_id=self.event["raw_event"]["topicId"],
+                    outcome_side=self.event_choice_index + 1,
+                )
+                if not self.position:
+                    raise Exception(f'Failed to found active position "{self.event["name"]}"')
+
+            self.amount = float(round_cut(self.position["tokenAmount"], 2))
+            self.usd_amount = round_cut(self.position["value"], 2)
+            self.token_id = self.position["tokenId"]
+
+
+    async def get_book(self, fresh: bool = False):
+        return await self.browser.get_event_book(
+            question_id=self.event["raw_event"]["questionId"],
+            symbol=self.event["raw_event"]["yesPos" if self.event_choice_index == 0 else "noPos"],
+            event_choice_index=self.event_choice_index,
+            fresh=fresh,
+        )
+
+
+    async def place(self):
+        book = await self.get_book(fresh=True)
+        amount = self.amount
+        if self.order_type == "market":
+            self.price = book["asks" if self.order_side == "buy" else "bids"][0]
+            taker_amount = 0
+
+        elif self.order_type == "limit":
+            self.price = self.opinion._calculate_limit_price(self.order_side, book)
+
+            if self.order_side == "buy":
+                taker_amount = float(round_cut(amount / self.price, 2))
+                amount = float(Decimal(str(taker_amount)) * Decimal(str(self.price)))
+            else:
+                taker_amount = float(Decimal(str(amount)) * Decimal(str(self.price)))
+
+        else:
+            raise CustomError(f'Unsupported order type `{self.order_type}`')
+
+        order_message = {
+            **self.opinion.TYPED_DATA["message"],
+            "salt": str(int(random() * int(time() * 1e3))),
+            "maker": self.opinion.proxy_wallet,
+            "signer": self.wallet.address,
+            "tokenId": self.token_id,
+            "makerAmount": str(int(Decimal(str(amount)) * Decimal('1e18'))),
+            "takerAmount": str(int(Decimal(str(taker_amount)) * Decimal('1e18'))),
+            "side": str(self.side),
+        }
+        signature = await self.wallet.sign_hash_async(self.opinion.ORDER_SIGNER.hash_message(order_message))
+
+        self.opinion.log_message(
+            f'{self.action_name} <green>{self.usd_amount} USDT</green> for {self.label} in <blue>{self.event["name"]}</blue> <green>at {round(self.price * 100, 2)}¢</green>',
+            level="INFO"
+        )
+        self.order_data = await self.browser.create_order(
+            typed_message=order_message,
+            signature=signature,
+            event_id=self.event["raw_event"]["topicId"],
+            safe_rate="0" if (self.order_side == "buy" and self.order_type == "market") else "0.05",
+            price=str(self.price) if self.order_type == "limit" else "0"
+        )
+
+
+    async def watch(self):
+        self.opinion.log_message(f"Waiting for {self.order_type} {self.order_side} order filled" + (f" {self.minutes_str}" if self.minutes_str else ""))
+        order_fill = self.browser.fill_watcher.watch(
+            trans_no=self.order_data["transNo"],
+            order_type=self.order_type,
+            topic_id=self.event["raw_event"]["topicId"],
+            is_parent=self.event["is_child"],
+        )
+        if self.order_type == "limit":
+            deadline = min(time() + self.to_wait_sec, self.total_deadline)
+
+        try:
+            while True:
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(order_fill),
+                        timeout=max(deadline - time(), 0) if self.order_type == "limit" else None,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+                if time() >= self.total_deadline:
+                    self.opinion.log_message(f"Limit order not filled in {LIMIT_SETTINGS['max_total_wait']} minutes total, cancelling...")
+                    self.exhausted = True
+                    return
+
+                book = await self.get_book()
+                if self.price == self.opinion._calculate_limit_price(self.order_side, book):
+                    self.opinion.log_message(f"Limit order not filled in {self.minutes_str}, but price not changed, waiting again...")
+                    deadline = min(time() + self.to_wait_sec, self.total_deadline)
+                    continue
+
+                if self.reprices >= LIMIT_SETTINGS["max_reprices"]:
+                    self.opinion.log_message(f"Limit order not filled after {self.reprices} reprices, cancelling...")
+                    self.exhausted = True
+                else:
+                    self.opinion.log_message(f"Limit order not filled in {self.minutes_str}, changing price...")
+                return
+
+        finally:
+            self.browser.fill_watcher.forget(self.order_data["transNo"])
+
+
+    async def cancel(self):
+        await self.browser.cancel_order(self.order_data["transNo"])
+        self.opinion.account.invalidate()
+        self.opinion.log_message(f'Cancelled order in "{self.event["name"]}"', level="INFO")
+        if self.order_side == "buy":
+            self.event["force_vote"] = self.event_choice_index + 1
+
+        # last poll of fill watcher can be seconds old - take final state of cancelled order
+        final_order = await self.browser.get_orders(
+            order_type=self.order_type,
+            topic_id=self.event["raw_event"]["topicId"],
+            trans_no=self.order_data["transNo"],
+            is_parent=self.event["is_child"],
+        )
+        self.order_data = None
+        return final_order
+
+
+    async def _cancel_after_error(self):
+        # dont leave live order on exchange when lifecycle failed, retry will place new one
+        trans_no, self.order_data = self.order_data["transNo"], None
+        try:
+            await self.browser.cancel_order(trans_no)
+            self.opinion.log_message(f'Cancelled order in "{self.event["name"]}" after error', level="INFO")
+        except Exception as err:
+            self.opinion.log_message(f'Failed to cancel order in "{self.event["name"]}" after error: {err}', level="WARNING")
+        finally:
+            self.opinion.account.invalidate()
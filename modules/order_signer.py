@@ -0,0 +1,40 @@
+from eth_utils import keccak, to_bytes
+
+
+class OrderSigner:
+    # EIP-712 hashing for one fixed struct: domain separator and type hash are computed once,
+    # struct fields are encoded directly instead of walking generic typed data each order
+    def __init__(self, typed_data: dict):
+        primary_type = typed_data["primaryType"]
+        self.fields = typed_data["types"][primary_type]
+
+        domain_fields = typed_data["types"]["EIP712Domain"]
+        self.domain_separator = keccak(
+            self._type_hash("EIP712Domain", domain_fields) +
+            b"".join(self._encode_value(field["type"], typed_data["domain"][field["name"]]) for field in domain_fields)
+        )
+        self.type_hash = self._type_hash(primary_type, self.fields)
+
+
+    @classmethod
+    def _type_hash(cls, name: str, fields: list):
+        return keccak(text=f'{name}({",".join(field["type"] + " " + field["name"] for field in fields)})')
+
+
+    @classmethod
+    def _encode_value(cls, value_type: str, value):
+        if value_type == "string":
+            return keccak(text=value)
+        elif value_type == "address":
+            return to_bytes(hexstr=value).rjust(32, b"\0")
+        elif value_type.startswith("uint"):
+            return int(value).to_bytes(32, "big")
+        raise ValueError(f'Unsupported EIP-712 type `{value_type}`')
+
+
+    def hash_message(self, message: dict):
+        struct_hash = keccak(
+            self.type_hash +
+            b"".join(self._encode_value(field["type"], message[field["name"]]) for field in self.fields)
+        )
+        return keccak(b"\x19\x01" + self.domain_separator + struct_hash)
@@ -0,0 +1,85 @@
+from urllib.parse import urlparse
+from collections import defaultdict
+from time import monotonic
+import asyncio
+
+from settings import RATE_LIMITS
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = monotonic()
+        self.lock = asyncio.Lock()  # waiters are served in FIFO order
+
+
+    async def acquire(self):
+        async with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated_at = monotonic()
+            self.tokens -= 1
+
+
+class RateLimiter:
+    FAMILIES = (
+        ("/order/market/depth", "depth"),
+        ("/topic", "topic"),
+        ("/order", "order"),
+        ("/portfolio", "portfolio"),
+    )
+
+    def __init__(self):
+        self.buckets: dict[str, TokenBucket] = {}
+        self.stats = defaultdict(lambda: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+
+
+    @classmethod
+    def get_family(cls, url: str):
+        url_path = urlparse(url).path
+        return next((family for path_part, family in cls.FAMILIES if path_part in url_path), "other")
+
+
+    def _get_bucket(self, name: str, limits_name: str):
+        if name not in self.buckets:
+            limits = RATE_LIMITS.get(limits_name)
+            self.buckets[name] = TokenBucket(rate=limits["rate"], burst=limits["burst"]) if limits else None
+        return self.buckets[name]
+
+
+    async def acquire(self, url: str, proxy: str | None):
+        family = self.get_family(url)
+        started_at = monotonic()
+
+        for bucket in [
+            self._get_bucket(name=family, limits_name=family),
+            self._get_bucket(name=f"proxy:{proxy}", limits_name="proxy"),
+        ]:
+            if bucket: await bucket.acquire()
+
+        waited = monotonic() - started_at
+        family_stats = self.stats[family]
+        family_stats["requests"] += 1
+        family_stats["total_wait"] += waited
+        family_stats["max_wait"] = max(family_stats["max_wait"], waited)
+
+
+    def get_metrics(self):
+        return {
+            family: {
+                "requests": family_stats["requests"],
+                "avg_wait": round(family_stats["total_wait"] / family_stats["requests"], 3),
+                "max_wait": round(family_stats["max_wait"], 3),
+            }
+            for family, family_stats in self.stats.items()
+        }
+
+
+rate_limiter = RateLimiter()
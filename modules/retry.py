@@ -1,11 +1,12 @@
-import asyncio
+from multidict import CIMultiDictProxy
+from dataclasses import dataclass
 from loguru import logger
+from typing import Any
+import asyncio
 
+from modules.utils import json_loads, JSONDecodeError
 from settings import RETRY
 
-from requests.exceptions import JSONDecodeError as json_error1
-from json.decoder import JSONDecodeError as json_error2
-
 
 class CustomError(Exception): pass
 
@@ -15,6 +16,8 @@ class OnetimeError(Exception): pass
 
 class SoftError(Exception): pass
 
+class TokenRejected(Exception): pass
+
 class TransactionError(Exception):
     def __init__(self, message: str, error_code: str, encoded_tx: str = ""):
         error_string = f"{message}: {error_code}" + (f" | encoded tx: {encoded_tx}" if encoded_tx else "")
@@ -23,16 +26,26 @@ class TransactionError(Exception):
         self.encoded_tx = encoded_tx
 
 
+@dataclass
+class JsonResponse:
+    status: int
+    headers: CIMultiDictProxy
+    data: Any
+
+
 def have_json(func):
     async def wrapper(*args, **kwargs):
         response = await func(*args, **kwargs)
+        async with response:
+            body = await response.read()
+
         try:
-            await response.json()
-        except (json_error1, json_error2):
-            error_msg = (await response.text())[:350].replace("\n", " ")
+            data = json_loads(body)
+        except JSONDecodeError:
+            error_msg = body[:350].decode(errors="replace").replace("\n", " ")
             raise Exception(f'bad json response: {error_msg}')
 
-        return response
+        return JsonResponse(status=response.status, headers=response.headers, data=data)
     return wrapper
 
 
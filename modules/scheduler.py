@@ -0,0 +1,66 @@
+from random import randint
+from time import time
+import asyncio
+import heapq
+
+from modules.browser import Browser
+from settings import SLEEP_AFTER_ACCOUNT
+
+
+class WalletScheduler:
+    # hands wallets to workers one by one, reading them from db lazily
+    # after wallet finishes its proxy cools down for `SLEEP_AFTER_ACCOUNT`: wallets with same proxy are
+    # held back until then, while workers take wallets with other proxies instead of sleeping.
+    # wallets without proxy have no shared cooldown
+    def __init__(self, all_wallets, deferred_limit: int):
+        self.all_wallets = iter(all_wallets)
+        self.deferred_limit = deferred_limit
+        self.deferred: list[tuple[float, int, dict]] = []  # (not before, order, wallet_data)
+        self.proxy_cooldowns: dict[str, float] = {}
+        self.order = 0
+        self.exhausted = False
+        self.lock = asyncio.Lock()
+
+
+    def cooldown(self, wallet_data: dict):
+        proxy = Browser.normalize_proxy(wallet_data["proxy"])
+        if proxy is None: return
+        not_before = time() + randint(*SLEEP_AFTER_ACCOUNT)
+        self.proxy_cooldowns[proxy] = max(self.proxy_cooldowns.get(proxy, 0), not_before)
+
+
+    def get_not_before(self, wallet_data: dict):
+        proxy = Browser.normalize_proxy(wallet_data["proxy"])
+        return self.proxy_cooldowns.get(proxy, 0) if proxy else 0
+
+
+    def _defer(self, wallet_data: dict, not_before: float):
+        heapq.heappush(self.deferred, (not_before, self.order, wallet_data))
+        self.order += 1
+
+
+    async def next_wallet(self):
+        async with self.lock:
+            while True:
+                now = time()
+
+                while self.deferred and self.deferred[0][0] <= now:
+                    _, _, wallet_data = heapq.heappop(self.deferred)
+                    not_before = self.get_not_before(wallet_data)
+                    if not_before <= now:
+                        return wallet_data
+                    self._defer(wallet_data, not_before)  # proxy was used again meanwhile
+
+                while not self.exhausted and len(self.deferred) < self.deferred_limit:
+                    wallet_data = next(self.all_wallets, None)
+                    if wallet_data is None:
+                        self.exhausted = True
+                        break
+                    not_before = self.get_not_before(wallet_data)
+                    if not_before <= now:
+                        return wallet_data
+                    self._defer(wallet_data, not_before)
+
+                if not self.deferred:
+                    return None
+                await asyncio.sleep(self.deferred[0][0] - now)
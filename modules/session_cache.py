@@ -0,0 +1,57 @@
+from cryptography.fernet import Fernet, InvalidToken
+from base64 import urlsafe_b64decode
+from time import time
+from os import path
+
+from modules.storage import atomic_write
+from modules.utils import json_loads, json_dumps, JSONDecodeError
+from settings import SESSION_CACHE
+
+
+def get_token_expiry(token: str):
+    # bearer token is JWT - take `exp` from its payload, otherwise consider it alive for `token_ttl`
+    try:
+        payload = token.split(".")[1]
+        exp = json_loads(urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"]
+        return int(exp)
+    except Exception:
+        return int(time() + SESSION_CACHE["token_ttl"] * 60)
+
+
+class SessionCache:
+    # address -> encrypted {"token", "expires_at", "registered", "proxy_wallet", "approved"}
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+        if path.isfile(self.file_name):
+            with open(self.file_name, 'rb') as f:
+                try: self.encrypted = json_loads(f.read()) or {}
+                except JSONDecodeError: self.encrypted = {}
+        else:
+            self.encrypted = {}
+        self.dirty = False
+
+
+    def get(self, address: str, personal_key: Fernet):
+        encrypted_session = self.encrypted.get(address)
+        if not encrypted_session:
+            return {}
+        try:
+            return json_loads(personal_key.decrypt(encrypted_session))
+        except (InvalidToken, JSONDecodeError):  # encrypted with other password
+            return {}
+
+
+    def set(self, address: str, session: dict, personal_key: Fernet):
+        self.encrypted[address] = personal_key.encrypt(json_dumps(session)).decode()
+        self.dirty = True
+
+
+    def flush(self):
+        if not self.dirty: return
+        self.dirty = False  # cleared before snapshot so changes made during write are not lost
+        try:
+            atomic_write(self.file_name, json_dumps(dict(self.encrypted)))
+        except Exception:
+            self.dirty = True
+            raise
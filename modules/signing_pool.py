@@ -0,0 +1,83 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from eth_keys import keys
+from itertools import count
+import asyncio
+
+from settings import SIGNING_SETTINGS
+
+
+# filled only inside signing processes: key is loaded into its process once per wallet, jobs carry only key id
+_worker_keys: dict[int, keys.PrivateKey] = {}
+
+
+def sign_digest(key: keys.PrivateKey, message_hash: bytes):
+    signature = key.sign_msg_hash(message_hash)
+    return '0x' + (
+        signature.r.to_bytes(32, "big") +
+        signature.s.to_bytes(32, "big") +
+        bytes([signature.v + 27])
+    ).hex()
+
+
+def load_key_job(key_id: int, privatekey: bytes):
+    _worker_keys[key_id] = keys.PrivateKey(privatekey)
+
+
+def unload_key_job(key_id: int):
+    _worker_keys.pop(key_id, None)
+
+
+def sign_hash_job(key_id: int, message_hash: bytes):
+    return sign_digest(_worker_keys[key_id], message_hash)
+
+
+class SigningPool:
+    def __init__(self):
+        # "process" uses one single-process executor per worker, so wallet key lives in exactly one known process
+        self.executors: list[Executor] = []
+        self.key_ids = count()
+
+
+    @property
+    def uses_processes(self):
+        return SIGNING_SETTINGS["executor"] == "process"
+
+
+    def get_executor(self, key_id: int = 0):
+        if not self.executors and SIGNING_SETTINGS["executor"]:
+            if SIGNING_SETTINGS["executor"] == "thread":
+                self.executors = [ThreadPoolExecutor(max_workers=SIGNING_SETTINGS["workers"])]
+            elif SIGNING_SETTINGS["executor"] == "process":
+                self.executors = [ProcessPoolExecutor(max_workers=1) for _ in range(SIGNING_SETTINGS["workers"])]
+            else:
+                raise ValueError(f'Unsupported signing executor: `{SIGNING_SETTINGS["executor"]}`')
+        return self.executors[key_id % len(self.executors)] if self.executors else None
+
+
+    async def load_key(self, key: keys.PrivateKey):
+        key_id = next(self.key_ids)
+        await asyncio.get_running_loop().run_in_executor(self.get_executor(key_id), load_key_job, key_id, key.to_bytes())
+        return key_id
+
+
+    async def unload_key(self, key_id: int):
+        executor = self.get_executor(key_id)
+        await asyncio.get_running_loop().run_in_executor(executor, unload_key_job, key_id)
+
+
+    async def sign_hash(self, key: keys.PrivateKey, key_id: int | None, message_hash: bytes):
+        executor = self.get_executor(key_id or 0)
+        if executor is None:
+            return sign_digest(key, message_hash)
+        elif key_id is None:  # threads share memory - sign with wallet's own key object
+            return await asyncio.get_running_loop().run_in_executor(executor, sign_digest, key, message_hash)
+        return await asyncio.get_running_loop().run_in_executor(executor, sign_hash_job, key_id, message_hash)
+
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+        self.executors = []
+
+
+signing_pool = SigningPool()
@@ -0,0 +1,400 @@
+from os import path, rename, replace, fsync
+import sqlite3
+
+from modules.utils import json_loads, json_dumps
+
+
+def atomic_write(file_name: str, data: bytes):
+    temp_name = file_name + ".tmp"
+    with open(temp_name, 'wb') as f:
+        f.write(data)
+        f.flush()
+        fsync(f.fileno())
+    replace(temp_name, file_name)
+
+
+class JsonStorage:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+        if path.isfile(self.file_name):
+            with open(self.file_name, 'rb') as f: self.modules_db = json_loads(f.read()) or {}
+        else:
+            self.modules_db = {}
+        self.amounts = self._count(self.modules_db)
+        self.dirty = False
+
+
+    def flush(self):
+        if not self.dirty: return
+        self.dirty = False  # cleared before snapshot so changes made during write are not lost
+        try:
+            atomic_write(self.file_name, json_dumps(self.modules_db))
+        except Exception:
+            self.dirty = True
+            raise
+
+
+    @classmethod
+    def _count(cls, modules_db: dict):
+        amounts = {'accs_amount': len(modules_db), 'modules_amount': 0, 'to_run': 0, 'failed': 0}
+        for wallet_data in modules_db.values():
+            amounts['modules_amount'] += len(wallet_data["modules"])
+            for module in wallet_data["modules"]:
+                status = "to_run" if module["status"] == "to_run" else "failed"
+                amounts[status] += 1
+        return amounts
+
+
+    def first_encoded_pk(self):
+        return next(iter(self.modules_db), None)
+
+
+    def clear(self):
+        self.modules_db = {}
+        self.amounts = self._count(self.modules_db)
+        self.dirty = True
+
+
+    def insert_wallets(self, wallets: dict):
+        if not wallets: return
+        self.modules_db.update(wallets)
+        for name, amount in self._count(wallets).items():
+            self.amounts[name] += amount
+        self.dirty = True
+
+
+    def get_addresses(self):
+        return {wallet_data["address"] for wallet_data in self.modules_db.values()}
+
+
+    def reset_failed(self):
+        reset_amount = self.amounts['failed']
+        if not reset_amount: return 0
+
+        for acc in self.modules_db:
+            for module in self.modules_db[acc]["modules"]:
+                if module["status"] in ["failed", "cloudflare"]: module["status"] = "to_run"
+        self.amounts['to_run'] += reset_amount
+        self.amounts['failed'] = 0
+        self.dirty = True
+        return reset_amount
+
+
+    def get_amounts(self):
+        return dict(self.amounts)
+
+
+    def get_pending_wallets(self, unique_wallets: bool = False):
+        return [
+            encoded_privatekey
+            for encoded_privatekey, wallet_data in self.modules_db.items()
+            if any(
+                module_info["status"] == "to_run" and
+                (not unique_wallets or module_index + 1 == len(wallet_data["modules"]))
+                for module_index, module_info in enumerate(wallet_data["modules"])
+            )
+        ]
+
+
+    def get_modules(self, unique_wallets: bool = False, wallet_key: str = None):
+        if wallet_key is None:
+            wallets = self.modules_db.items()
+        else:
+            wallets = [(wallet_key, self.modules_db[wallet_key])] if wallet_key in self.modules_db else []
+        return [
+            {
+                'encoded_privatekey': encoded_privatekey,
+                'proxy': wallet_data.get("proxy"),
+                'address': wallet_data["address"],
+                'module_id': None,
+                'module_info': dict(module_info),
+                'last': module_index + 1 == len(wallet_data["modules"])
+            }
+            for encoded_privatekey, wallet_data in wallets
+            for module_index, module_info in enumerate(wallet_data["modules"])
+            if (
+                    module_info["status"] == "to_run" and
+                    (not unique_wallets or module_index + 1 == len(wallet_data["modules"]))
+            )
+        ]
+
+
+    def finish_module(self, encoded_pk: str, module_name: str, module_id: int | None, completed: bool):
+        wallet_modules = self.modules_db[encoded_pk]["modules"]
+
+        found = False
+        for index, module in enumerate(wallet_modules):
+            if module["module_name"] == module_name and module["status"] == "to_run":
+                found = True
+                self.amounts['to_run'] -= 1
+                if completed:
+                    wallet_modules.remove(module)
+                    self.amounts['modules_amount'] -= 1
+                else:
+                    wallet_modules[index]["status"] = "failed"
+                    self.amounts['failed'] += 1
+                break
+
+        to_run_left = [module["status"] for module in wallet_modules].count("to_run")
+        if not wallet_modules:
+            del self.modules_db[encoded_pk]
+            self.amounts['accs_amount'] -= 1
+
+        self.dirty = True
+        return found, to_run_left
+
+
+    def finish_account(self, encoded_pk: str, completed: bool):
+        wallet_amounts = self._count({encoded_pk: self.modules_db[encoded_pk]})
+        if completed:
+            del self.modules_db[encoded_pk]
+            for name, amount in wallet_amounts.items():
+                self.amounts[name] -= amount
+        else:
+            self.modules_db[encoded_pk]["modules"] = [
+                {**module, "status": "failed"}
+                for module in self.modules_db[encoded_pk]["modules"]
+            ]
+            self.amounts['to_run'] -= wallet_amounts['to_run']
+            self.amounts['failed'] += wallet_amounts['to_run']
+        self.dirty = True
+
+
+class SqliteStorage:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS wallets (
+            id          INTEGER PRIMARY KEY,
+            encoded_pk  TEXT NOT NULL UNIQUE,
+            address     TEXT NOT NULL,
+            proxy       TEXT
+        );
+        CREATE TABLE IF NOT EXISTS modules (
+            id          INTEGER PRIMARY KEY,
+            wallet_id   INTEGER NOT NULL REFERENCES wallets(id) ON DELETE CASCADE,
+            module_name TEXT NOT NULL,
+            status      TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS modules_wallet_status ON modules(wallet_id, status);
+        CREATE INDEX IF NOT EXISTS modules_status ON modules(status);
+
+        CREATE TABLE IF NOT EXISTS counters (
+            name        TEXT PRIMARY KEY,
+            amount      INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS wallets_insert AFTER INSERT ON wallets BEGIN
+            INSERT INTO counters VALUES ('accounts', 1) ON CONFLICT(name) DO UPDATE SET amount = amount + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS wallets_delete AFTER DELETE ON wallets BEGIN
+            UPDATE counters SET amount = amount - 1 WHERE name = 'accounts';
+        END;
+        CREATE TRIGGER IF NOT EXISTS modules_insert AFTER INSERT ON modules BEGIN
+            INSERT INTO counters VALUES ('modules', 1) ON CONFLICT(name) DO UPDATE SET amount = amount + 1;
+            INSERT INTO counters VALUES ('status:' || NEW.status, 1) ON CONFLICT(name) DO UPDATE SET amount = amount + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS modules_delete AFTER DELETE ON modules BEGIN
+            UPDATE counters SET amount = amount - 1 WHERE name IN ('modules', 'status:' || OLD.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS modules_update AFTER UPDATE OF status ON modules WHEN OLD.status != NEW.status BEGIN
+            UPDATE counters SET amount = amount - 1 WHERE name = 'status:' || OLD.status;
+            INSERT INTO counters VALUES ('status:' || NEW.status, 1) ON CONFLICT(name) DO UPDATE SET amount = amount + 1;
+        END;
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+        self.conn = sqlite3.connect(self.file_name, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+        if self.conn.execute("SELECT 1 FROM counters LIMIT 1").fetchone() is None:
+            self._rebuild_counters()
+
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+
+    def flush(self):
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+
+
+    def _wallet_id(self, encoded_pk: str):
+        row = self.conn.execute("SELECT id FROM wallets WHERE encoded_pk = ?", (encoded_pk,)).fetchone()
+        if row is None:
+            raise KeyError(encoded_pk)
+        return row["id"]
+
+
+    def _rebuild_counters(self):
+        with self.transaction():
+            self.conn.execute("DELETE FROM counters")
+            self.conn.execute("INSERT INTO counters SELECT 'accounts', COUNT(*) FROM wallets")
+            self.conn.execute("INSERT INTO counters SELECT 'modules', COUNT(*) FROM modules")
+            self.conn.execute("INSERT INTO counters SELECT 'status:' || status, COUNT(*) FROM modules GROUP BY status")
+        self.flush()
+
+
+    def _counter(self, name: str):
+        row = self.conn.execute("SELECT amount FROM counters WHERE name = ?", (name,)).fetchone()
+        return row["amount"] if row else 0
+
+
+    def _insert_wallets(self, wallets: dict):
+        for encoded_pk, wallet_data in wallets.items():
+            wallet_id = self.conn.execute(
+                "INSERT INTO wallets (encoded_pk, address, proxy) VALUES (?, ?, ?)",
+                (encoded_pk, wallet_data["address"], wallet_data.get("proxy")),
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO modules (wallet_id, module_name, status) VALUES (?, ?, ?)",
+                [(wallet_id, module["module_name"], module["status"]) for module in wallet_data["modules"]],
+            )
+
+
+    def first_encoded_pk(self):
+        row = self.conn.execute("SELECT encoded_pk FROM wallets ORDER BY id LIMIT 1").fetchone()
+        return row["encoded_pk"] if row else None
+
+
+    def clear(self):
+        with self.transaction():
+            self.conn.execute("DELETE FROM modules")
+            self.conn.execute("DELETE FROM wallets")
+
+
+    def insert_wallets(self, wallets: dict):
+        with self.transaction():
+            self._insert_wallets(wallets)
+
+
+    def get_addresses(self):
+        return {row["address"] for row in self.conn.execute("SELECT address FROM wallets")}
+
+
+    def migrate_from_json(self, file_name: str):
+        if self.first_encoded_pk() is not None or not path.isfile(file_name):
+            return 0
+
+        with open(file_name, 'rb') as f: modules_db = json_loads(f.read())
+        if not modules_db:
+            return 0
+
+        with self.transaction():
+            self._insert_wallets(modules_db)
+        self.flush()
+        rename(file_name, file_name + ".migrated")
+        return len(modules_db)
+
+
+    def reset_failed(self):
+        with self.transaction():
+            return self.conn.execute("UPDATE modules SET status = 'to_run' WHERE status IN ('failed', 'cloudflare')").rowcount
+
+
+    def get_amounts(self):
+        return {
+            'accs_amount': self._counter('accounts'),
+            'modules_amount': self._counter('modules'),
+            'to_run': self._counter('status:to_run'),
+            'failed': self._counter('status:failed') + self._counter('status:cloudflare'),
+        }
+
+
+    def get_pending_wallets(self, unique_wallets: bool = False):
+        rows = self.conn.execute(f"""
+            SELECT DISTINCT m.wallet_id FROM modules m
+            WHERE m.status = 'to_run' {"AND m.id = (SELECT MAX(id) FROM modules WHERE wallet_id = m.wallet_id)" if unique_wallets else ""}
+            ORDER BY m.wallet_id
+        """)
+        return [row["wallet_id"] for row in rows]
+
+
+    def get_modules(self, unique_wallets: bool = False, wallet_key: int = None):
+        rows = self.conn.execute(f"""
+            SELECT w.encoded_pk, w.address, w.proxy, m.id, m.module_name, m.status,
+                   m.id = (SELECT MAX(id) FROM modules WHERE wallet_id = w.id) AS last
+            FROM modules m JOIN wallets w ON w.id = m.wallet_id
+            WHERE m.status = 'to_run' {"AND last" if unique_wallets else ""} {"AND w.id = ?" if wallet_key is not None else ""}
+            ORDER BY m.id
+        """, () if wallet_key is None else (wallet_key,))
+        return [
+            {
+                'encoded_privatekey': row["encoded_pk"],
+                'proxy': row["proxy"],
+                'address': row["address"],
+                'module_id': row["id"],
+                'module_info': {"module_name": row["module_name"], "status": row["status"]},
+                'last': bool(row["last"]),
+            }
+            for row in rows
+        ]
+
+
+    def finish_module(self, encoded_pk: str, module_name: str, module_id: int | None, completed: bool):
+        with self.transaction():
+            wallet_id = self._wallet_id(encoded_pk)
+            if module_id is None:
+                row = self.conn.execute(
+                    "SELECT id FROM modules WHERE wallet_id = ? AND module_name = ? AND status = 'to_run' ORDER BY id LIMIT 1",
+                    (wallet_id, module_name),
+                ).fetchone()
+                module_id = row["id"] if row else None
+
+            if completed:
+                query = "DELETE FROM modules WHERE id = ? AND status = 'to_run'"
+            else:
+                query = "UPDATE modules SET status = 'failed' WHERE id = ? AND status = 'to_run'"
+            found = self.conn.execute(query, (module_id,)).rowcount > 0
+
+            to_run_left, modules_left = self.conn.execute(
+                "SELECT SUM(status = 'to_run'), COUNT(*) FROM modules WHERE wallet_id = ?",
+                (wallet_id,),
+            ).fetchone()
+            if not modules_left:
+                self.conn.execute("DELETE FROM wallets WHERE id = ?", (wallet_id,))
+
+        return found, to_run_left or 0
+
+
+    def finish_account(self, encoded_pk: str, completed: bool):
+        with self.transaction():
+            wallet_id = self._wallet_id(encoded_pk)
+            if completed:
+                self.conn.execute("DELETE FROM wallets WHERE id = ?", (wallet_id,))
+            else:
+                self.conn.execute("UPDATE modules SET status = 'failed' WHERE wallet_id = ?", (wallet_id,))
+
+
+class _Transaction:
+    # changes are kept in one open transaction until `SqliteStorage.flush` commits them,
+    # every operation gets its own savepoint to be rolled back alone
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("SAVEPOINT operation")
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self.conn.execute("ROLLBACK TO operation")
+        self.conn.execute("RELEASE operation")
+
+
+def get_storage(engine: str, db_folder: str):
+    if engine == "sqlite":
+        storage = SqliteStorage(f"{db_folder}/modules.db")
+        storage.migrate_from_json(f"{db_folder}/modules.json")
+        return storage
+
+    elif engine == "json":
+        return JsonStorage(f"{db_folder}/modules.json")
+
+    raise ValueError(f'Unsupported DB_ENGINE: `{engine}`')
@@ -9,5 +9,7 @@ from .utils import (
     get_response_error_reason,
 )
 from .window_name import WindowName
+from .cache import TtlCache
+from .json_codec import json_loads, json_dumps, JSONDecodeError
 from .modes import choose_mode
 from .tg_report import TgReport
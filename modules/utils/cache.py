@@ -0,0 +1,42 @@
+from typing import Any, Awaitable, Callable, Hashable
+from time import monotonic
+import asyncio
+
+
+class TtlCache:
+    def __init__(self, ttl: float, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.values: dict[Hashable, tuple[float, Any]] = {}
+        self.pending: dict[Hashable, asyncio.Task] = {}
+
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable], fresh: bool = False):
+        if not fresh:
+            cached = self.values.get(key)
+            if cached and cached[0] > monotonic():
+                return cached[1]
+
+            # someone is already fetching this key - wait for his result instead of sending same request
+            if key in self.pending:
+                return await asyncio.shield(self.pending[key])
+
+        task = asyncio.ensure_future(fetch())
+        self.pending[key] = task
+        task.add_done_callback(lambda done_task: self._on_fetched(key, done_task))
+        return await asyncio.shield(task)
+
+
+    def _on_fetched(self, key: Hashable, task: asyncio.Task):
+        if self.pending.get(key) is task:
+            del self.pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self.values[key] = (monotonic() + self.ttl, task.result())
+
+            if len(self.values) > self.max_size:
+                now = monotonic()
+                self.values = {k: v for k, v in self.values.items() if v[0] > now}
+
+
+    def clear(self):
+        self.values.clear()
@@ -0,0 +1,23 @@
+from json import JSONDecodeError
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson is optional: it decodes big `/topic` and `/portfolio` responses few times faster
+if orjson:
+    def json_loads(data: bytes | str):
+        return orjson.loads(data)
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+else:
+    def json_loads(data: bytes | str):
+        return json.loads(data)
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
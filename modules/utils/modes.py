@@ -55,10 +55,11 @@ def choose_mode():
 
     if answer.soft_id == 0:
         answer = ask_question(
-            question="💾 You want to delete current and create new database?",
+            question="💾 You want to delete current and create new database or add new wallets?",
             modes=[
                 Mode(soft_id=-1, type="", text="← Exit", is_numeric=False),
                 Mode(soft_id=101, type="database",  text="Delete current and create new database", is_numeric=False),
+                Mode(soft_id=102, type="database",  text="Add new privatekeys to current database", is_numeric=False),
             ]
         )
 
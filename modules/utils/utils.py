@@ -3,7 +3,8 @@ from datetime import datetime
 from decimal import Decimal
 from random import randint
 from loguru import logger
-from time import sleep
+from typing import Any, Callable
+from time import sleep, monotonic
 from web3 import Web3
 from tqdm import tqdm
 import asyncio
@@ -120,6 +121,13 @@ def get_response_error_reason(response: dict):
 def round_cut(value: float | str | Decimal, digits: int):
     return Decimal(str(int(float(value) * 10 ** digits) / 10 ** digits))
 
-async def async_sleep(seconds: int):
-    for _ in range(int(seconds)):
-        await asyncio.sleep(1)
+async def async_sleep(seconds: float, progress: Callable[[float, float], Any] | None = None, progress_interval: float = 10):
+    # one timer for the whole sleep, loop is woken up more often only to report `progress(slept, total)`
+    if seconds <= 0: return
+    if progress is None:
+        return await asyncio.sleep(seconds)
+
+    deadline = monotonic() + seconds
+    while (left := deadline - monotonic()) > 0:
+        await asyncio.sleep(min(progress_interval, left))
+        progress(min(seconds - (deadline - monotonic()), seconds), seconds)
@@ -4,7 +4,10 @@ from eth_account.messages import (
     _hash_eip191_message
 )
 from web3.auto import w3
+from eth_keys import keys
+import asyncio
 
+from modules.signing_pool import signing_pool, sign_digest
 from modules.database import DataBase
 
 
@@ -21,6 +24,8 @@ class Wallet:
 
         self.account = w3.eth.account.from_key(privatekey) if privatekey else None
         self.address = self.account.address if privatekey else None
+        self.key = keys.PrivateKey(self.account.key) if privatekey else None
+        self.key_loading: asyncio.Task | None = None  # loads key into signing process and gives its id, only with "process" executor
 
 
     def sign_message(
@@ -40,3 +45,30 @@ class Wallet:
         signature = signed_message.signature.hex()
         if not signature.startswith('0x'): signature = '0x' + signature
         return signature
+
+
+    def sign_hash(self, message_hash: bytes):
+        # same signature as `sign_message` gives for already hashed EIP-712 message
+        return sign_digest(self.key, message_hash)
+
+
+    async def sign_message_async(self, text: str):
+        return await self.sign_hash_async(_hash_eip191_message(encode_defunct(text=text)))
+
+
+    async def sign_hash_async(self, message_hash: bytes):
+        key_id = None
+        if signing_pool.uses_processes:
+            if self.key_loading is None:  # concurrent first signatures wait for the same loading
+                self.key_loading = asyncio.ensure_future(signing_pool.load_key(self.key))
+            key_id = await self.key_loading
+        return await signing_pool.sign_hash(self.key, key_id, message_hash)
+
+
+    async def release_key(self):
+        if self.key_loading is None: return
+        key_loading, self.key_loading = self.key_loading, None
+        try:
+            await signing_pool.unload_key(await key_loading)
+        except Exception:  # pool is already shut down or key was never loaded
+            pass
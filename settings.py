@@ -1,5 +1,6 @@
 
 SHUFFLE_WALLETS     = True                              # True | False - перемешивать ли кошельки
+DB_ENGINE           = "sqlite"                          # sqlite | json - где хранить базу модулей (json будет перенесен в sqlite автоматически)
 RETRY               = 3
 
 GWEI_MULTIPLIER     = 1.2                               # умножать текущий гвей при отправке транз на 20%
@@ -30,6 +31,7 @@ BID_SETTINGS            = {
     "PARSE"             : {
         "max_spread"        : 2,                        # максимальная разница (покупка/продажа) при ставке - 2 цента
         "min_event_percent" : 25,                       # выбирать ставки в которых минимальный процент исхода не менее 25%
+        "parallel_books"    : 5,                        # сколько стаканов событий проверять одновременно
     }
 }
 BID_AMOUNTS             = [2, 4]                        # каждый аккаунт должен покупать+продавать от 2 до 4 событий
@@ -44,13 +46,50 @@ LIMIT_SETTINGS          = {
                                                         # время не исполнится - переставляет по актуальной цене
     "diff_price_sell"   : 0,                            # тоже самое - на продажу
     "to_wait_sell"      : 1,                            # тоже самое - на продажу
+    "max_reprices"      : 10,                           # сколько раз максимум переставлять лимитку по новой цене
+    "max_total_wait"    : 30,                           # сколько минут максимум ждать исполнения лимитки со всеми переставлениями
 }
+FILL_CHECK_INTERVAL     = [3, 15]                       # проверять исполнение ордеров каждые 3 секунды, если ордер долго не меняется - постепенно реже, до 15 секунд
 
 SLEEP_BETWEEN_ORDERS    = [5, 10]                       # задержка между покупкой и продажей эвента
-SLEEP_AFTER_ACCOUNT     = [30, 40]                      # задержка после каждого аккаунта
+SELL_ALL_PARALLEL       = 5                             # сколько ордеров одновременно отменять и позиций одновременно продавать в режиме продажи всего
+SLEEP_AFTER_ACCOUNT     = [30, 40]                      # задержка после каждого аккаунта перед следующим аккаунтом с тем же прокси...
+                                                        # ...в это время поток берет аккаунты с другими прокси. аккаунты без прокси запускаются без задержки
 
 # --- GENERAL SETTINGS ---
 THREADS             = 1                                 # количество потоков (одновременно работающих кошельков)
+SIGNING_SETTINGS    = {                                 # подписи (логин и ордера) вне основного потока, чтобы не тормозить остальные кошельки
+    "executor"          : None,                         # None - подписывать в основном потоке | "thread" - в потоках | "process" - в отдельных процессах (на все ядра)
+    "workers"           : 4,                            # количество потоков/процессов для подписей
+}
+CONNECTION_SETTINGS = {                                 # общий пул соединений для всех аккаунтов с одинаковым прокси
+    "limit_per_host"    : 10,                           # максимум одновременных соединений к одному хосту
+    "keepalive_timeout" : 30,                           # сколько секунд держать неиспользуемое соединение открытым
+    "dns_cache_ttl"     : 300,                          # сколько секунд кешировать DNS
+}
+RATE_LIMITS         = {                                 # ограничение запросов: rate - запросов в секунду, burst - сколько можно отправить разом
+                                                        # укажите None чтобы не ограничивать группу
+    "topic"             : {"rate": 5, "burst": 10},     # списки событий
+    "depth"             : {"rate": 10, "burst": 20},    # стаканы событий
+    "order"             : {"rate": 5, "burst": 10},     # создание, отмена и проверка ордеров
+    "portfolio"         : {"rate": 5, "burst": 10},     # позиции
+    "other"             : {"rate": 5, "burst": 10},     # логин, профиль и остальное
+    "proxy"             : {"rate": 5, "burst": 10},     # отдельный лимит на каждый прокси
+}
+CACHE_SETTINGS      = {                                 # общий кеш запросов для всех аккаунтов
+    "topics_ttl"        : 60,                           # сколько секунд кешировать список событий для парсинга
+    "book_ttl"          : 1,                            # сколько секунд кешировать стакан события (цена для ордера всегда берется свежая)
+}
+SESSION_CACHE       = {                                 # сохранять логин аккаунтов (токен, прокси кошелек, апрув) между запусками в зашифрованном виде
+    "enabled"           : True,                         # True | False - использовать ли сохраненные логины
+    "token_ttl"         : 60,                           # сколько минут считать токен живым, если срок жизни не указан в самом токене
+    "min_token_left"    : 60,                           # использовать сохраненный токен только если он проживет еще 60+ минут (на все модули кошелька)...
+                                                        # ...если токен все равно истечет во время работы - софт перелогинится и повторит запрос
+}
+DB_FLUSH            = {                                 # как часто сохранять изменения базы на диск
+    "interval"      : 500,                              # раз в 500 миллисекунд
+    "mutations"     : 100,                              # или сразу после 100 изменений
+}
 
 
 # --- PERSONAL SETTINGS ---